@@ -1 +1 @@
-from .scoro import Scoro
\ No newline at end of file
+from .scoro import Scoro, AsyncScoro, Log, CompactLog, Term
\ No newline at end of file
@@ -1,15 +1,46 @@
+import asyncio
+import bisect
+import collections
+import collections.abc
+import contextlib
 import copy
+import ctypes
+import ctypes.util
+import fnmatch
+import functools
 import glob
+import itertools
+import json
+import math
 import operator
 import os
+import re
+import select
 import shutil
+import sqlite3
+import struct
+import threading
+import time
+import weakref
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl asking the filesystem to share the blocks of one file with another
+FICLONE = 0x40049409
+
 
 class Scoro:
     def __init__(self, storage="./storage/", logs="./logs/", output="./output/",
-                 initialized_titles=None, reset=False, close=True, send=False):
+                 initialized_titles=None, reset=False, close=True, send=False, transfer="copy", workers=1,
+                 journal=0, compact=False, scan_workers=1, shard=None, shard_width=2, catalog=False,
+                 instrument=False, hook=None, text=False, lazy=False):
         """
         Scoro is a system for tracking of text based logs. Each log is a text file that contains multiple entries
         storing details about the file name.
@@ -23,10 +54,50 @@ class Scoro:
         :param reset: [Optional] If you want to reset the log contents on startup (Does not delete any files)
         :param close: [Optional] Upon closing of the program, will autoset unless told not to
         :param send: [Optional] Upon pull, send all files to the 'output' folder
+        :param transfer: [Optional] How pulled files are sent: copy, hardlink, symlink, reflink or move
+        :param workers: [Optional] Number of threads sending pulled files
+        :param journal: [Optional] Journals each (un)check at once, folding it into the log after this many. 0 waits for settle
+        :param compact: [Optional] Keeps log contents compactly, for logs of very many terms
+        :param scan_workers: [Optional] Number of processes parsing storage when many files are new to the index
+        :param shard: [Optional] Layout of storage: flat, attribute or hash. Default keeps the layout storage has
+        :param shard_width: [Optional] Number of hex digits naming each folder of the hash layout
+        :param catalog: [Optional] Keeps the index and the terms of each log in an SQLite database beside the logs
+        :param instrument: [Optional] Times each phase and counts the work done, see stats
+        :param hook: [Optional] Function called with the name and seconds of each phase as it ends. Turns on instrument
+        :param text: [Optional] Indexes the words in the contents of created files, for CONTAINS in queries
+        :param lazy: [Optional] Registers logs by their file names only, reading each and scanning storage on first use
         """
         self.logs = {}
+
+        # Titles of logs registered but not yet read or filled from storage, only in lazy mode
+        self.lazy = lazy
+        self.unloaded = set()
+
+        # Logs by order, the logs sorted by order, and the lowest order that might be open
+        self.orders = {}
+        self.ordered_logs = None
+        self.open_order = 1
         self.close = close
         self.send = send
+        self.transfer_mode = transfer
+        self.workers = workers
+        self.journal = journal
+        self.log_type = CompactLog if compact else Log
+        self.scan_workers = scan_workers
+        self.last_transfer = {}
+
+        # Held while logs or the index change. Only AsyncScoro swaps in a real lock, for its threads
+        self.lock = contextlib.nullcontext()
+
+        # Timers and counters, doing nothing unless turned on
+        self.instruments = Stats(instrument, hook)
+
+        # Compiled selection of unchecked terms, reused until a log changes
+        self.selection = None
+        self.selection_key = None
+
+        # Last facets counted and what they were counted from
+        self.facets_cache = (None, None)
 
         if storage:
             self.location_storage = storage.rstrip("/") + "/"
@@ -47,6 +118,18 @@ class Scoro:
         Path(self.location_storage).mkdir(parents=True, exist_ok=True)
         Path(self.location_output).mkdir(parents=True, exist_ok=True)
 
+        # Inverted index of storage, kept beside the logs
+        if shard and shard not in Index.layouts:
+            print(f"Storage layout not found: {shard}")
+            shard = None
+        self.index_options = (Catalog if catalog else Index, shard, shard_width)
+        self.opened_index = None
+        if not lazy:
+            self.open_index()
+
+        # Words in the contents of files, only kept when asked for
+        self.text_index = TextIndex(self.location_logs, self.location_storage) if text else None
+
         # Creates logs for any titles you want
         if initialized_titles:
             self.add_log(initialized_titles)
@@ -56,6 +139,47 @@ class Scoro:
         if reset:
             self.reset()
 
+    @property
+    def index(self):
+        """
+        Inverted index of storage, opened on first use in lazy mode
+        :rtype: Index
+        """
+        return self.opened_index or self.open_index()
+
+    def open_index(self):
+        """
+        Loads the index of storage kept beside the logs
+        :rtype: Index
+        """
+        index_type, shard, shard_width = self.index_options
+        with self.instruments.phase("load index"):
+            self.opened_index = index_type(self.location_logs, self.location_storage, shard, shard_width,
+                                           self.instruments)
+        return self.opened_index
+
+    def ensure_loaded(self, titles=""):
+        """
+        Reads and fills the logs still unloaded in lazy mode, before an operation needs their contents
+        :param str or list[str] titles: Logs needed, all logs when empty
+        :return: If any log was loaded
+        :rtype: bool
+        """
+        if not self.unloaded:
+            return False
+
+        if not titles:
+            pending = list(self.unloaded)
+        else:
+            if type(titles) != list:
+                titles = [titles]
+            pending = [x for x in titles if x in self.unloaded]
+
+        if not pending:
+            return False
+        self.renew(storage=False, logs=False, log_by_name=pending)
+        return True
+
     # Settles contents to each log upon close
     def __del__(self):
         if self.close:
@@ -90,8 +214,20 @@ class Scoro:
         Method for writing all contents to their folder.
         If scoro was deliberately called with settle=False, this method should be called before the last line of your program
         """
-        for indx in [*self.logs.values()]:
-            indx.write_contents()
+        with self.lock, self.instruments.phase("settle"):
+            for indx in [*self.logs.values()]:
+                if indx.is_dirty():
+                    indx.write_contents()
+                    self.instruments.count("logs_written")
+                    if self.instruments.enabled:
+                        self.instruments.count("bytes_written", os.path.getsize(indx.address))
+
+            # An index never opened has nothing to save
+            if self.opened_index:
+                self.opened_index.record(self.logs.values())
+                self.opened_index.save()
+            if self.text_index:
+                self.text_index.save()
 
     def add_log(self, title, order=-1, generate=True):
         """
@@ -114,20 +250,48 @@ class Scoro:
         # Fill in gaps with negative -1
         order = order + [-1] * ((len(title) - len(order)) * (len(title) - len(order) > 0))
 
-        # For each in list of titles
-        for i in range(len(title)):
-            if title[i] not in self.logs.keys():
-                # If the order wasn't manually specified
-                if order[i] == -1:
-                    order[i] = self.get_open_order()
+        with self.lock:
+            # Builds every new log first
+            added = []
+            for i in range(len(title)):
+                if title[i] not in self.logs.keys():
+                    # If the order wasn't manually specified
+                    if order[i] == -1:
+                        order[i] = self.get_open_order()
+
+                    # Creates the log then adds
+                    log_to_add = self.log_type(title[i], self.location_logs, order[i], self.journal,
+                                               weakly(self.held_terms, frozenset()))
+                    self.register_log(log_to_add)
+                    added.append(title[i])
+
+            # Then fills all of them in a single pass over storage, or on first use in lazy mode
+            if generate and added:
+                if self.lazy:
+                    for ttitl in added:
+                        # Nothing read means nothing to settle, until the log is first used
+                        self.logs[ttitl].mark_written()
+                        self.logs[ttitl].loader = functools.partial(weakly(self.ensure_loaded), ttitl)
+                    self.unloaded.update(added)
+                else:
+                    self.renew(storage=False, logs=False, log_by_name=added)
+
+    def bulk_add_logs(self, pairs, generate=True):
+        """
+        Adds many logs at once, filling them with a single pass over storage
+        :param pairs: dict or list of (title, order) pairs. An order of -1 uses the first possible
+        :param boolean generate: [Optional] Generates the logs from storage content
+        """
+        if type(pairs) == dict:
+            pairs = pairs.items()
 
-                # Creates the log then adds
-                log_to_add = Log(title[i], self.location_logs, order[i])
-                self.logs[title[i]] = log_to_add
+        titles = []
+        orders = []
+        for title, order in pairs:
+            titles.append(title)
+            orders.append(int(order))
 
-                # Refresh this log only
-                if generate:
-                    self.renew(storage=False, logs=False, log_by_name=title)
+        return self.add_log(titles, order=orders, generate=generate)
 
     def delete_log(self, title="", all=False):
         """
@@ -148,14 +312,15 @@ class Scoro:
             title = [title]
 
         # For each in list of titles to delete
-        for ttitl in title:
-            if ttitl in self.logs.keys():
-                os.remove(self.logs[ttitl].address)
-                del self.logs[ttitl]
+        with self.lock:
+            for ttitl in title:
+                if ttitl in self.logs.keys():
+                    self.logs[ttitl].delete()
+                    self.unregister_log(ttitl)
 
-            else:
-                print("While attempting to delete log: log name \"{}\" not found".format(title))
-                return False
+                else:
+                    print("While attempting to delete log: log name \"{}\" not found".format(title))
+                    return False
 
     def get_logs_dict(self) -> dict:
         """
@@ -181,26 +346,56 @@ class Scoro:
 
         :rtype: int
         """
-        taken_orders = []
-        for indx in self.logs.values():
-            taken_orders.append(indx.get_order())
+        while self.open_order in self.orders:
+            self.open_order += 1
+        return self.open_order
 
-        if len(taken_orders) == 0 or 1 not in taken_orders:
-            return 1
+    def register_log(self, log):
+        """
+        Adds a log object to the logs, keeping the lookups by order current
+        :param Log log: The log to add
+        """
+        self.logs[log.title] = log
+        self.orders.setdefault(log.get_order(), log)
+        self.ordered_logs = None
 
-        taken_orders.sort()
-        for i in range(1, len(taken_orders) + 1):
-            if i not in taken_orders:
-                return i
-        else:
-            return len(taken_orders) + 1
+    def unregister_log(self, title):
+        """
+        Removes a log object from the logs, keeping the lookups by order current
+        :param str title: The title of the log to remove
+        """
+        log = self.logs.pop(title)
+        self.unloaded.discard(title)
+        orde = log.get_order()
+        if self.orders.get(orde) is log:
+            del self.orders[orde]
+
+            # Another log may share the order
+            for indx in self.logs.values():
+                if indx.get_order() == orde:
+                    self.orders[orde] = indx
+                    break
+
+        if orde not in self.orders:
+            self.open_order = min(self.open_order, orde)
+        self.ordered_logs = None
+
+    def get_ordered_logs(self) -> tuple:
+        """
+        Returns the logs sorted by order, sorting again only after a log was added or deleted
+        :rtype: tuple
+        """
+        if self.ordered_logs is None:
+            self.ordered_logs = tuple(sorted(self.logs.values(), key=operator.attrgetter('order')))
+        return self.ordered_logs
 
-    def renew(self, storage=True, logs=False, log_by_name=""):
+    def renew(self, storage=True, logs=False, log_by_name="", full=False):
         """
         Load or reloads logs from files and opens logs
         :param log_by_name: A specific log that you want to renew
         :param logs: Log(s) to fill
         :param storage: Fill log(s) or all logs with storage contents
+        :param full: Rescans every file of storage rather than only those added or removed since the last scan
         """
 
         def load_logs(self, generate=True):
@@ -221,17 +416,20 @@ class Scoro:
                     all_log_addresses.append(file)
 
             # If there isn't an address associated with any log, then make a new one
+            new_logs = []
             for addre in all_log_addresses:
                 if addre not in current_log_addresses:
                     split_addr = Path(addre).stem.split("_")
-                    self.add_log(split_addr[0], order=int(split_addr[1]), generate=generate)
+                    new_logs.append((split_addr[0], int(split_addr[1])))
+            self.bulk_add_logs(new_logs, generate=generate)
 
-        def fill_logs(self, logs=""):
+        def fill_logs(self, logs="", full=False):
             """
             Loads the storage onto the log
             Rewrites the contents
             :param self: The Scoro object
             :param logs: str or list[str]
+            :param full: Rescans all of storage
             """
             # Local storage - Retrieving all files in the local files
             # Loads only a logs
@@ -249,24 +447,22 @@ class Scoro:
                         log_orders.append(self.logs[log].get_order())
                 local_files_dict = {int(x): {} for x in log_orders}
 
-            # Accumulation of all files for storage
-            for file in glob.glob(self.location_storage + "*"):
-
-                stripped_files = Path(file).stem.split("__", 1)[0]
-                full_term = stripped_files.split("_")
-
-                # Adds each occurrence of a term to a dictionary
-                for log_num, value in enumerate(full_term):
-                    if not value:
-                        continue
-                    if log_num + 1 in local_files_dict:
-                        local_files_dict[log_num + 1][value] = Term.checked
+            # Accumulation of all files for storage, only new or removed files are parsed
+            with self.instruments.phase("scan"):
+                self.index.sync(full=full, workers=self.scan_workers)
+            for orde in local_files_dict:
+                local_files_dict[orde] = self.index.get_terms(orde)
 
-            # Gets all contents of currently in logs
+            # Gets all contents of currently in logs, which are loaded from here on
             log_dict = {}
             dict_of_all_log_contents = {}
             for log in self.logs.values():
-                log_dict[log.get_order()] = log.grab_contents()
+                if log.get_order() in local_files_dict:
+                    log.loader = None
+            with self.instruments.phase("grab"):
+                for log in self.logs.values():
+                    if log.get_order() in local_files_dict:
+                        log_dict[log.get_order()] = log.grab_contents()
 
             for orde, grabbed_contents in local_files_dict.items():
                 dict_of_all_log_contents[orde] = {}
@@ -285,17 +481,41 @@ class Scoro:
 
                 log_to_add = self.get_log_by_order(orde)
                 if checked_items:
-                    log_to_add.add(checked_items, checked=True)
+                    self.instruments.count("terms_added", log_to_add.add(checked_items, checked=True))
                 if unchecked_items:
-                    log_to_add.add(unchecked_items, checked=False)
+                    self.instruments.count("terms_added", log_to_add.add(unchecked_items, checked=False))
+
+                # Nothing to settle if storage agrees with the file
+                if log_to_add.get_contents() == log_dict.get(orde):
+                    log_to_add.mark_written()
+
+            # Filled logs are loaded, whether lazily registered or not
+            if not logs:
+                self.unloaded.clear()
+            else:
+                self.unloaded.difference_update(logs)
 
             if self.close:
                 self.settle()
 
-        if logs:
-            load_logs(self, not storage)
-        if storage or log_by_name:
-            fill_logs(self, log_by_name)
+        with self.lock, self.instruments.phase("renew"):
+            if logs:
+                load_logs(self, not storage)
+            if storage or log_by_name:
+                fill_logs(self, log_by_name, full)
+
+    def held_terms(self, order, terms) -> set:
+        """
+        Returns which of some terms of an order the files in storage still carry, syncing the index first
+        :param int order: The order of the terms
+        :param list terms: The terms
+        :rtype: set
+        """
+        with self.lock:
+            with self.instruments.phase("scan"):
+                self.index.sync(workers=self.scan_workers)
+            found = self.index.get_terms(order)
+        return {x for x in terms if x in found}
 
     def get_log_by_order(self, order):
         """
@@ -304,10 +524,7 @@ class Scoro:
         :return: Log belonging to param order
         :rtype: Log
         """
-        for indx in self.logs.values():
-            if order == indx.get_order():
-                return indx
-        return None
+        return self.orders.get(order)
 
     def get_log_content(self, title) -> dict:
         """
@@ -318,6 +535,7 @@ class Scoro:
         :rtype dict
         """
         if title in self.logs:
+            self.ensure_loaded(title)
             return self.logs[title].get_contents()
         else:
             return {}
@@ -334,63 +552,373 @@ class Scoro:
         Prints all contents of all logs
         """
         # Calls post method of each log
-        for indx in sorted(self.logs.values(), key=operator.attrgetter('order')):
+        self.ensure_loaded()
+        for indx in self.get_ordered_logs():
             indx.post()
 
-    def pull(self, match=False, send=False, output=""):
+    def pull(self, match=False, send=False, output="", mode="", workers=0, query=""):
         """
         Retrieves each file that is unmarked
         :param send: Sends all files to output
         :param output: path of folder for pulling to. Default is in folder
         :param match: If the output needs to fit each marked log
+        :param mode: How files are sent, see transfer
+        :param workers: Number of threads sending files, see transfer
+        :param query: Pulls the files fitting a query instead of those unmarked, see query
         :returns List of all unchecked files
         """
-        terms_to_get = {int(x.get_order()): [] for x in self.logs.values()}
+        if query:
+            files_of_interest = self.query(query)
+            if (send or self.send) and files_of_interest:
+                self.last_transfer = self.transfer(files_of_interest, output, mode, workers)
+            return files_of_interest
 
-        # Fills dictionary by order: [terms to get]
-        for indx in self.logs.values():
-            for term, czeched in indx.get_contents().items():
-                if czeched == Term.unchecked:
-                    terms_to_get[indx.order].append(term)
+        with self.lock, self.instruments.phase("pull"):
+            selection = self.get_selection()
 
-        # Goes through each file in storage
-        files_of_interest = []
-        for file in glob.glob(self.location_storage + "*"):
-            split_term = Path(file).stem.split("_")
+            # Brings the index up to date, then selects from it rather than scanning storage
+            with self.instruments.phase("scan"):
+                self.index.sync()
+            self.index.record(self.logs.values())
+            files_of_interest = [self.location_storage + x for x in sorted(self.index.select(selection, match))]
+            self.instruments.count("files_pulled", len(files_of_interest))
 
-            # If matched, the output will be specific to only what's in the matching
-            if match:
-                for i in range(len(split_term)):
-                    try:
-                        if not terms_to_get[i + 1]:
-                            continue
+        # Outputs to folder
+        if send or self.send:
+            self.last_transfer = self.transfer(files_of_interest, output, mode, workers)
+        return files_of_interest
 
-                        # Every term is specific in match
-                        if split_term[i] not in terms_to_get[i + 1]:
-                            break
-                    except KeyError:
-                        pass
+    def index_contents(self, workers=0, full=False) -> int:
+        """
+        Indexes the words in the contents of files not yet indexed, such as those made before the text index
+        or by other programs, and of files changed since
+        :param workers: Number of processes reading files. Default is scan_workers
+        :param full: Reads every file of storage again
+        :return: Number of files read
+        :rtype: int
+        """
+        if not self.text_index:
+            print("Contents aren't indexed, open scoro with text=True")
+            return 0
+
+        with self.lock, self.instruments.phase("index contents"):
+            self.index.sync()
+            read = self.text_index.backfill(self.index.get_files(), workers or self.scan_workers, full)
+            if self.close:
+                self.text_index.save()
+        self.instruments.count("files_read", read)
+        return read
+
+    def query(self, expression) -> list:
+        """
+        Returns the files fitting a boolean query over the terms of the logs, leaving every log as it is.
+        Such as: type in {pie,tarte} AND NOT fruit=kiwi AND stars>=2
+        Clauses are log=term, log!=term, log in {term,...}, log not in {term,...}, log~regex and <, <=, >, >= on numbers.
+        Terms with *, ? or [ are glob patterns unless quoted. Clauses join with AND, OR, NOT and parentheses.
+        With text=True, CONTAINS word or CONTAINS {word,...} finds files by their contents
+        :param str expression: The query
+        :return: List of paths of the files
+        :rtype: list[str]
+        """
+        try:
+            query = Query(expression)
+        except ValueError as error:
+            print(f"Query not understood: {error}")
+            return []
+
+        with self.lock, self.instruments.phase("query"):
+            self.index.sync()
+            try:
+                tree = query.resolve(self.logs, self.index, self.text_index)
+            except ValueError as error:
+                print(f"Query not understood: {error}")
+                return []
+            found = query.evaluate(tree, self.index)
+        return [self.location_storage + x for x in sorted(found)]
+
+    def iter_pull(self, match=False, send=False, output="", mode="", workers=0):
+        """
+        Yields each file that is unmarked as storage is scanned, rather than gathering them all first
+        :param match: If the output needs to fit each marked log
+        :param send: Sends each file to output as it is found
+        :param output: path of folder for pulling to. Default is the output folder
+        :param mode: How files are sent, see transfer
+        :param workers: Number of threads sending files while the scan carries on
+        :return: Generator of paths of unchecked files
+        """
+        selection = self.get_selection()
+        send = send or self.send
+        mode = mode or self.transfer_mode
+        workers = workers or self.workers
+        if send and mode not in transfers:
+            print(f"Transfer mode not found: {mode}")
+            return
+
+        if not output:
+            output = self.location_output
+        output = output.rstrip("/") + "/"
+        if send:
+            Path(output).mkdir(parents=True, exist_ok=True)
+
+        pool = ThreadPoolExecutor(max_workers=workers) if send and workers > 1 else None
+        pending = collections.deque()
+        try:
+            for name in self.index.walk():
+                if not selection.is_wanted(split_name(name), match):
+                    continue
+
+                file = self.location_storage + name
+                if pool:
+                    # Only a few sends are kept waiting, so memory doesn't grow with the pull
+                    pending.append(pool.submit(send_file, file, output, mode))
+                    if len(pending) > workers * 2:
+                        pending.popleft().result()
+                elif send:
+                    send_file(file, output, mode)
+                yield file
+
+            for future in pending:
+                future.result()
+        finally:
+            if pool:
+                pool.shutdown(wait=True)
+
+    def facets(self, selection=None, match=False) -> dict:
+        """
+        Returns how many files carry each term of each log, read from the index.
+        Kept until storage or, for a selection of logs or a query, the logs change
+        :param selection: [Optional] Counts only some files: True for those a pull would give,
+                          a query (see query), or a list of paths. Default counts all of storage
+        :param match: If the files of a pull need to fit each marked log, with selection=True
+        :return: Dictionary of log title: {term: number of files}
+        :rtype: dict
+        """
+        with self.lock, self.instruments.phase("facets"):
+            self.index.sync()
+            logs = tuple((x.title, x.get_order()) for x in self.logs.values())
+
+            key = None
+            if selection is None:
+                key = (self.index.changes, logs)
+            elif selection is True or type(selection) == str:
+                key = (self.index.changes, logs, tuple(x.version for x in self.logs.values()), selection, match)
+            if key is not None and self.facets_cache[0] == key:
+                return self.facets_cache[1]
+
+            if selection is None:
+                found = {title: self.index.facet(orde) for title, orde in logs}
+            else:
+                if selection is True:
+                    self.index.record(self.logs.values())
+                    names = self.index.select(self.get_selection(), match)
+                elif type(selection) == str:
+                    names = self.query(selection)
                 else:
-                    files_of_interest.append(file)
+                    names = selection
+
+                # One pass over the names, counting every order at once
+                counts = {orde: collections.Counter() for _, orde in logs}
+                for name in names:
+                    terms = split_name(name)
+                    for orde, counter in counts.items():
+                        if orde <= len(terms) and terms[orde - 1]:
+                            counter[terms[orde - 1]] += 1
+                found = {title: dict(counts[orde]) for title, orde in logs}
+
+            if key is not None:
+                self.facets_cache = (key, found)
+        return found
+
+    def get_to_pull(self) -> dict:
+        """
+        Returns the unchecked terms of every log by order
+        :rtype: dict
+        """
+        self.ensure_loaded()
+        terms_to_get = {int(x.get_order()): set() for x in self.logs.values()}
+
+        # Fills dictionary by order: {terms to get}
+        for indx in self.logs.values():
+            terms_to_get[indx.order].update(indx.get_to_pull(unchecked=True))
+        return terms_to_get
+
+    def get_selection(self):
+        """
+        Returns the compiled selection of unchecked terms, compiling it again only once a log has changed
+        :rtype: Selection
+        """
+        self.ensure_loaded()
+        key = tuple(x.version for x in self.logs.values())
+        if self.selection is None or key != self.selection_key:
+            sizes = {x.get_order(): len(x.get_contents()) for x in self.logs.values()}
+            self.selection = Selection(self.get_to_pull(), sizes)
+            self.selection_key = key
+        return self.selection
+
+    def transfer(self, files, output="", mode="", workers=0) -> dict:
+        """
+        Sends files to the output folder
+        :param files: Paths of the files to send
+        :param output: path of folder for sending to. Default is the output folder
+        :param mode: copy, hardlink, symlink, reflink or move. Default is the mode scoro was opened with
+        :param workers: Number of threads sending files. Default is the number scoro was opened with
+        :return: Summary with the mode, number of files, bytes and seconds elapsed
+        :rtype: dict
+        """
+        mode = mode or self.transfer_mode
+        workers = workers or self.workers
+        if mode not in transfers:
+            print(f"Transfer mode not found: {mode}")
+            return {}
 
-            # If not match, if the term contains any of the identifiers, then its accepted
+        if not output:
+            output = self.location_output
+        output = output.rstrip("/") + "/"
+        Path(output).mkdir(parents=True, exist_ok=True)
+
+        start = time.perf_counter()
+        with self.instruments.phase("transfer"):
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    sizes = list(pool.map(send_file, files, itertools.repeat(output), itertools.repeat(mode)))
             else:
-                for i in range(len(split_term)):
-                    try:
-                        if split_term[i] in terms_to_get[i + 1]:
-                            files_of_interest.append(file)
-                    except KeyError:
-                        pass
+                sizes = [send_file(file, output, mode) for file in files]
+        self.instruments.count("files_sent", len(sizes))
+        self.instruments.count("bytes_sent", sum(sizes))
+
+        # Moved files are no longer in storage
+        if mode == "move":
+            with self.lock:
+                for file in files:
+                    self.index.discard(os.path.relpath(file, self.location_storage))
+                    if self.text_index:
+                        self.text_index.discard(os.path.relpath(file, self.location_storage))
+
+        return {"mode": mode, "files": len(sizes), "bytes": sum(sizes), "elapsed": time.perf_counter() - start}
+
+    def reshard(self, layout, width=2) -> int:
+        """
+        Moves the files of storage into a new layout. File names and the terms of each log are kept
+        :param layout: flat, attribute (a folder per first attribute) or hash (a folder per hash prefix)
+        :param width: Number of hex digits naming each folder of the hash layout
+        :return: Number of files moved
+        :rtype: int
+        """
+        if layout not in Index.layouts:
+            print(f"Storage layout not found: {layout}")
+            return 0
 
-        # Outputs to folder
-        if send or self.send:
-            if not output:
-                output = self.location_output
+        with self.lock:
+            moved = self.index.reshard(layout, width)
+            self.index.save()
+        return moved
 
-            for file in files_of_interest:
-                new_dest = output.rstrip("/") + "/" + Path(file).name
-                shutil.copy(file, new_dest)
-        return files_of_interest
+    def stats(self, reset=False) -> dict:
+        """
+        Returns the time spent in each phase (load index, renew, scan, parse, grab, settle, save index, pull,
+        transfer, create) and counters of the work done, when scoro was opened with instrument or a hook
+        :param reset: Starts the timers and counters over after reading them
+        :return: {"phases": {phase: {"calls", "seconds"}}, "counters": {counter: amount}}
+        :rtype: dict
+        """
+        report = self.instruments.report()
+        if reset:
+            self.instruments.clear()
+        return report
+
+    def apply_changes(self, added=(), removed=()):
+        """
+        Takes files made or removed in storage into the index and the logs, without scanning storage.
+        Terms of new files are added checked, as on renew
+        :param added: Paths of files made, relative to storage
+        :param removed: Paths of files removed, relative to storage
+        :return: Number of files added and removed
+        :rtype: int
+        """
+        terms_by_order = {}
+        for name in added:
+            for orde, term in enumerate(split_name(name), 1):
+                if term and orde in self.orders:
+                    terms_by_order.setdefault(orde, set()).add(term)
+
+        with self.lock:
+            self.index.add_many(added, self.scan_workers)
+            for name in removed:
+                self.index.discard(name)
+                if self.text_index:
+                    self.text_index.discard(name)
+            for orde, terms in terms_by_order.items():
+                # Logs not yet loaded take the terms from the index once they are
+                if self.orders[orde].title not in self.unloaded:
+                    self.instruments.count("terms_added", self.orders[orde].add(list(terms), checked=True))
+        return len(added) + len(removed)
+
+    def watch(self, interval=1.0, debounce=2.0, stop=None, timeout=None, poll=False) -> dict:
+        """
+        Keeps the logs and the index current with storage while files are made, removed or renamed by other programs.
+        Events are taken in batches, and logs are settled once storage has been quiet for a while.
+        Uses inotify on Linux, otherwise polls storage, which is only listed again once a folder has changed
+        :param interval: Longest seconds waited for events before checking stop, and seconds between polls
+        :param debounce: Seconds without changes before settling, when scoro settles on close
+        :param threading.Event stop: [Optional] Watching ends once set, for watching on another thread
+        :param timeout: [Optional] Seconds to watch for. Default is until stop is set
+        :param poll: Polls storage even where inotify is offered
+        :return: Number of files added and removed
+        :rtype: dict
+        """
+        watcher = None
+        if not poll:
+            try:
+                watcher = Watcher(self.index)
+            except OSError:
+                watcher = None
+
+        totals = {"added": 0, "removed": 0}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        unsettled = False
+        last_change = 0.0
+        try:
+            while not (stop and stop.is_set()):
+                wait = interval
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        break
+
+                if watcher:
+                    changed = watcher.read(wait)
+
+                    # Names may have come and gone within the batch, so storage has the last word
+                    added = {x for x in changed if os.path.lexists(os.path.join(self.index.storage, x))}
+                    removed = changed.difference(added)
+                    if watcher.overflowed:
+                        found = self.index.sync()
+                        added.update(found[0])
+                        removed.update(found[1])
+                else:
+                    if stop:
+                        stop.wait(wait)
+                    else:
+                        time.sleep(wait)
+                    with self.lock:
+                        added, removed = self.index.sync()
+
+                with self.instruments.phase("watch"):
+                    if self.apply_changes(added, removed):
+                        totals["added"] += len(added)
+                        totals["removed"] += len(removed)
+                        unsettled = True
+                        last_change = time.monotonic()
+
+                if unsettled and self.close and time.monotonic() - last_change >= debounce:
+                    self.settle()
+                    unsettled = False
+        finally:
+            if watcher:
+                watcher.close()
+            if unsettled and self.close:
+                self.settle()
+        return totals
 
     def has_term(self, term, log=""):
         """
@@ -400,6 +928,7 @@ class Scoro:
         :param log: The log(s) to go through
         :return: bool
         """
+        self.ensure_loaded(log)
 
         logs_to_check = {}
         if log:
@@ -429,57 +958,84 @@ class Scoro:
         else:
             return False
 
-    def uncheck(self, terms, log="", pattern=False):
+    def uncheck(self, terms="", log="", pattern=False, regex=False, predicate=None, low=None, high=None):
         """
         Marks each term as unchecked for the purposes of pulling.
         Can specify logs or leave open for every log
-        :param pattern: NOT IMPLEMENTED
+        :param pattern: Treats each term as a glob pattern, such as 'blue*' or '*berry'
         :param terms: String or list of strings to uncheck in Logs
         :param log: Log to check. Default is all Logs
+        :param regex: Treats each term as a regular expression
+        :param predicate: Function taking a term and returning if it is unchecked
+        :param low: Lowest number unchecked, for logs of numbers
+        :param high: Highest number unchecked, for logs of numbers
         """
+        with self.lock:
+            for indx, selected in self.select(terms, log, pattern, regex, predicate, low, high).items():
+                self.logs[indx].uncheck(selected)
 
-        if not log:
-            log = self.get_logs_names()
-
-        elif type(log) is not list:
-            log = [log]
-
-        if type(terms) is not list:
-            terms = [terms]
-
-        for indx in log:
-            if indx in self.logs:
-                _indx = self.logs[indx]
-                _indx.uncheck(terms)
-
-            else:
-                continue
-
-    def check(self, terms, log=""):
+    def check(self, terms="", log="", pattern=False, regex=False, predicate=None, low=None, high=None):
         """
         Checks all terms passed in for given log.
         If log is blank, then checks it for all
 
         :param terms: Term or terms that you want to look for
         :param log: If you want to specify a log
+        :param pattern: Treats each term as a glob pattern, such as 'blue*' or '*berry'
+        :param regex: Treats each term as a regular expression
+        :param predicate: Function taking a term and returning if it is checked
+        :param low: Lowest number checked, for logs of numbers
+        :param high: Highest number checked, for logs of numbers
         :return:
         """
+        with self.lock:
+            for indx, selected in self.select(terms, log, pattern, regex, predicate, low, high).items():
+                self.logs[indx].check(selected)
+
+    def select(self, terms="", log="", pattern=False, regex=False, predicate=None, low=None, high=None) -> dict:
+        """
+        Returns the terms of each log that a check or uncheck with the same parameters would mark
+        :param terms: Term or terms that you want to look for
+        :param log: If you want to specify a log. Default is all Logs
+        :param pattern: Treats each term as a glob pattern
+        :param regex: Treats each term as a regular expression
+        :param predicate: Function taking a term and returning if it is selected
+        :param low: Lowest number selected, for logs of numbers
+        :param high: Highest number selected, for logs of numbers
+        :return: Dictionary of log title: list of terms
+        :rtype: dict
+        """
         if not log:
             log = self.get_logs_names()
 
         elif type(log) is not list:
             log = [log]
+        self.ensure_loaded(log)
 
         if type(terms) is not list:
             terms = [terms]
 
+        selecting = pattern or regex or predicate or low is not None or high is not None
+
+        selected = {}
         for indx in log:
-            if indx in self.logs:
-                _indx = self.logs[indx]
-                _indx.check(terms)
-            else:
+            if indx not in self.logs:
+                continue
+
+            if not selecting:
+                selected[indx] = terms
                 continue
 
+            # Every term is its own pattern, and a term is selected by any of them. An empty one selects nothing
+            found = set()
+            for term in terms:
+                if (pattern or regex) and not term:
+                    continue
+                found.update(self.logs[indx].select(pattern=term if pattern else "", regex=term if regex else "",
+                                                    predicate=predicate, low=low, high=high))
+            selected[indx] = sorted(found)
+        return selected
+
     def create(self, attributes, content, extension=""):
         """
         Creates a file with attributes as a title, content for content, and an extension
@@ -487,7 +1043,7 @@ class Scoro:
         :param list attributes: A list of details to give to the file
         :param content: The content that you wish to write as the body of the file
         :param extension: Default txt. The extension of the file
-        :return:
+        :return: Path of the created file
         """
         if type(attributes) is not list:
             attributes = [attributes]
@@ -498,35 +1054,73 @@ class Scoro:
         else:
             extension = "." + extension.lstrip(".")
 
-        found = False
-        pathh = ""
-        i = 0
-        while not found:
-            file_stem = "_".join(attributes) if len(attributes) > 1 else ''.join(attributes)
-            if i > 0:
-                file_stem += f"__{i}"
-
-            pathh = self.location_storage + file_stem + extension
-            if not os.path.exists(pathh):
-                found = True
-
-            else:
-                if i == 0:
-                    i = 2
-                else:
-                    i += 1
-
-        file = open(pathh, "w")
-        file.write(str(content))
+        file_stem = "_".join(attributes)
+        with self.instruments.phase("create"):
+            with self.lock:
+                file_name, descriptor = self.index.claim(file_stem, extension)
+            with os.fdopen(descriptor, "w") as file:
+                file.write(str(content))
+            if self.instruments.enabled:
+                self.instruments.count("bytes_written", os.path.getsize(self.location_storage + file_name))
+
+            # Adds each attribute to their logs, except those not yet loaded which read it from the index
+            with self.lock:
+                for log, attribute in zip(self.get_ordered_logs(), attributes):
+                    if log.title not in self.unloaded:
+                        self.instruments.count("terms_added", log.add(attribute))
+                if self.text_index:
+                    self.text_index.add(file_name, str(content))
+        return self.location_storage + file_name
+
+    def create_many(self, records, extension=""):
+        """
+        Creates a file for each record, then updates and settles the logs once for the whole batch
+
+        :param records: Iterable of (attributes, content) pairs, as given to create
+        :param extension: Default txt. The extension of every file
+        :return: List of paths of the created files
+        :rtype: list[str]
+        """
+        if not extension:
+            extension = ".txt"
+        else:
+            extension = "." + extension.lstrip(".")
 
-        logs_by_order = [x for x in self.logs.values()]
-        logs_by_order.sort(key=lambda f: f.order)
+        logs_by_order = self.get_ordered_logs()
+        terms_by_order = [set() for _ in logs_by_order]
+
+        created = []
+        with self.instruments.phase("create"):
+            for attributes, content in records:
+                if type(attributes) not in (list, tuple):
+                    attributes = [attributes]
+                attributes = [str(x) for x in attributes]
+
+                # Duplicates are numbered from the index's counters rather than probing storage
+                with self.lock:
+                    file_name, descriptor = self.index.claim("_".join(attributes), extension)
+                with os.fdopen(descriptor, "w") as filee:
+                    filee.write(str(content))
+                created.append(self.location_storage + file_name)
+                if self.text_index:
+                    with self.lock:
+                        self.text_index.add(file_name, str(content))
+
+                for orde, term in enumerate(attributes[:len(logs_by_order)]):
+                    terms_by_order[orde].add(term)
+
+            if self.instruments.enabled:
+                self.instruments.count("bytes_written", sum(os.path.getsize(x) for x in created))
+
+            # Adds each attribute to their logs
+            with self.lock:
+                for log, terms in zip(logs_by_order, terms_by_order):
+                    if terms and log.title not in self.unloaded:
+                        self.instruments.count("terms_added", log.add(list(terms)))
 
-        # Adds each attribute to their logs
-        for i in range(len(logs_by_order)):
-            if i > len(attributes) - 1:
-                break
-            logs_by_order[i].add(attributes[i])
+        if self.close:
+            self.settle()
+        return created
 
     def clear(self):
         """
@@ -534,33 +1128,187 @@ class Scoro:
         """
         for log in self.logs.values():
             log.clear_contents()
+            log.loader = None
+        self.unloaded.clear()
 
     def reset(self):
         """
         Resets each log to having no terms unchecked
         """
+        self.ensure_loaded()
         for indx in self.logs.values():
             indx.check_all_contents()
 
 
+class AsyncScoro:
+    """
+    AsyncScoro: Awaitable create, pull, settle and renew over a Scoro, for programs running on asyncio.
+    Calls run on a thread pool of bounded size; logs and the index are changed by one thread at a time,
+    while file contents and transfers are written side by side.
+    Open with 'await AsyncScoro.open(...)' taking the parameters of Scoro, or wrap an existing Scoro
+    :param Scoro scoro: The Scoro to run calls on
+    :param int concurrency: [Optional] Most calls running at once
+    """
+
+    def __init__(self, scoro, concurrency=8):
+        self.scoro = scoro
+        self.scoro.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.limit = asyncio.Semaphore(concurrency)
+
+    @classmethod
+    async def open(cls, *args, concurrency=8, **kwargs):
+        """
+        Opens a Scoro without blocking the event loop
+        :param int concurrency: [Optional] Most calls running at once
+        Every other parameter is passed on to Scoro
+        :rtype: AsyncScoro
+        """
+        scoro = await asyncio.get_running_loop().run_in_executor(None, functools.partial(Scoro, *args, **kwargs))
+        return cls(scoro, concurrency)
+
+    async def run(self, method, *args, **kwargs):
+        """
+        Runs any method of the Scoro on the thread pool, once there is room for it
+        :param method: The method, or the name of it
+        :return: What the method returns
+        """
+        if type(method) == str:
+            method = getattr(self.scoro, method)
+
+        async with self.limit:
+            return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                    functools.partial(method, *args, **kwargs))
+
+    async def create(self, attributes, content, extension=""):
+        """
+        Creates a file, see Scoro.create
+        :return: Path of the created file
+        """
+        return await self.run(self.scoro.create, attributes, content, extension)
+
+    async def create_many(self, records, extension=""):
+        """
+        Creates a file for each record, see Scoro.create_many
+        :return: List of paths of the created files
+        """
+        return await self.run(self.scoro.create_many, records, extension)
+
+    async def pull(self, match=False, send=False, output="", mode="", workers=0, query=""):
+        """
+        Retrieves each file that is unmarked, see Scoro.pull
+        :return: List of all unchecked files
+        """
+        return await self.run(self.scoro.pull, match, send, output, mode, workers, query)
+
+    async def settle(self):
+        """
+        Writes all changed logs and the index, see Scoro.settle
+        """
+        return await self.run(self.scoro.settle)
+
+    async def renew(self, storage=True, logs=False, log_by_name="", full=False):
+        """
+        Load or reloads logs, see Scoro.renew
+        """
+        return await self.run(self.scoro.renew, storage, logs, log_by_name, full)
+
+    async def close(self):
+        """
+        Settles, unless the Scoro was opened with close=False, then stops the thread pool
+        """
+        if self.scoro.close:
+            await self.settle()
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
 class Log:
     """
     Log: The files that are being tracked
     :param title: Title of the log
     :param root: The folder containing the log
     :param order: The order that is tracked from the attributes
+    :param journal: Number of toggles kept in the journal before folding them into the log. 0 keeps no journal
+    :param held: Function taking an order and terms, returning those that files in storage still carry.
+                 Terms other writers added to the file are only kept if held. Default keeps none
     """
+    # Stamps each change to any log, so a stamp is never shared by two states
+    versions = itertools.count(1)
 
-    def __init__(self, title, root, order):
+    def __init__(self, title, root, order, journal=0, held=None):
         self.title = title
+        self.held = held
         self.order = order
         self.address = root.rstrip("/") + "/" + self.title + "_" + str(self.order) + ".lst"
 
+        # Toggles appended since the log was last written, as '+term' (unchecked) or ';term' (checked)
+        self.journal = journal
+        self.journal_address = self.address[:-len(".lst")] + ".jnl"
+        self.journaled = 0
+
         # Creates a new file
         Path(self.address).touch(exist_ok=True)
 
-        # Initializes contents
+        # Initializes contents, unwritten until the first settle
         self.contents = {}
+        self.written = None
+
+        # Reads the contents on first access, for logs registered before being read
+        self.loader = None
+
+        # Terms (un)checked here since the last write, which keep their state over other writers
+        self.changed = set()
+        self.touch(reshaped=True)
+        self.sorted_cache = (None, [])
+        self.numbers_cache = (None, [], [])
+
+    def touch(self, reshaped=False):
+        """
+        Marks the contents as changed
+        :param reshaped: If terms were added or removed, rather than only (un)checked
+        """
+        self.version = next(Log.versions)
+        if reshaped:
+            self.terms_version = self.version
+
+    def sorted_terms(self) -> list:
+        """
+        Returns the terms of the log in order, sorting them again only once terms were added or removed
+        :rtype: list[str]
+        """
+        if self.sorted_cache[0] != self.terms_version:
+            self.sorted_cache = (self.terms_version, sorted(self.contents))
+        return self.sorted_cache[1]
+
+    def sorted_numbers(self) -> tuple:
+        """
+        Returns the terms of the log that are numbers, in order, beside their values
+        :return: Tuple of the list of values and the list of terms
+        :rtype: tuple
+        """
+        if self.numbers_cache[0] != self.terms_version:
+            self.numbers_cache = (self.terms_version, *sort_numbers(self.sorted_terms()))
+        return self.numbers_cache[1], self.numbers_cache[2]
+
+    def select(self, pattern="", regex="", predicate=None, low=None, high=None) -> list:
+        """
+        Returns the terms of the log meeting every criterion given.
+        Prefixes and ranges are found by bisecting the sorted terms, anything else takes one pass over them
+        :param str pattern: Glob pattern, such as 'blue*' or '*berry'
+        :param str regex: Regular expression searched for in each term
+        :param predicate: Function taking a term and returning if it is selected
+        :param low: Lowest number selected, for logs of numbers
+        :param high: Highest number selected, for logs of numbers
+        :rtype: list[str]
+        """
+        self.load()
+        return select_terms(self.sorted_terms(), self.sorted_numbers, pattern, regex, predicate, low, high)
 
     def path(self) -> str:
         """
@@ -569,23 +1317,31 @@ class Log:
         return self.address
 
     def get_contents(self) -> dict:
+        self.load()
         return self.contents
 
     def add(self, terms, checked=True):
         """
         Adds a term to the log
+        :return: Number of terms added
         """
+        self.load()
         if not terms:
             print("Failed to add term: Term left blank")
 
         if type(terms) != list:
             terms = [terms]
 
+        length = len(self.contents)
         for _trm in terms:
             _trm = str(_trm)
             if _trm not in self.contents.keys():
                 self.contents[_trm] = Term.checked if checked else Term.unchecked
 
+        if len(self.contents) != length:
+            self.touch(reshaped=True)
+        return len(self.contents) - length
+
     def get_order(self) -> int:
         """
         Returns what number of the order the log is
@@ -600,6 +1356,7 @@ class Log:
         :return: contents of log
         :rtype: list of Term
         """
+        self.load()
         all_terms = []
         checked_bias = True if ((checked or unchecked) and (checked is not unchecked)) else False
 
@@ -619,21 +1376,36 @@ class Log:
         """
         Deletes everything in the log
         """
-        filee = open(self.address, "w")
+        with locked(self.address):
+            open(self.address, "w").close()
+            self.drop_journal()
         self.contents = {}
+        self.changed = set()
+        self.touch(reshaped=True)
+        self.mark_written()
 
     def check_all_contents(self):
         """
         Resets the log so that every term is checked
         """
+        self.load()
         contents_copy = copy.deepcopy(self.contents)
         for key, value in contents_copy.items():
             self.contents[key] = Term.checked
+        self.changed.update(contents_copy)
+        self.touch()
 
     def grab_contents(self):
         """
         Grabs the contents of a log from the file
         """
+        with locked(self.address, shared=True):
+            return self.read_contents()
+
+    def read_contents(self):
+        """
+        Reads the contents of a log and its journal from the files, without locking them
+        """
         contents = {}
         filee = open(self.address, "r")
         r = filee.readlines()
@@ -644,31 +1416,123 @@ class Log:
                 contents[appended_line.lstrip(";")] = Term.checked if appended_line[0] == ';' else Term.unchecked
 
         filee.close()
+
+        # Replays any toggles journaled since the file was last written
+        self.journaled = 0
+        try:
+            with open(self.journal_address, "r") as filee:
+                for line in filee:
+                    appended_line = line.rstrip("\n")
+                    if appended_line:
+                        contents[appended_line[1:]] = Term.checked if appended_line[0] == ';' else Term.unchecked
+                        self.journaled += 1
+        except FileNotFoundError:
+            pass
+
         # self.contents = contents
         return contents
 
+    def merge(self, contents):
+        """
+        Takes in terms and states written by others.
+        Terms (un)checked here since the last write keep their state, any other term takes the written one.
+        A term this log doesn't hold is only taken if files in storage still carry it, so terms of removed files drop
+        :param dict contents: term: Term as read from the file
+        """
+        new = [x for x in contents if x not in self.contents]
+        held = self.held(self.order, new) if new and self.held else set()
+
+        added = False
+        changed = False
+        for term, state in contents.items():
+            if term in self.changed:
+                continue
+
+            current = self.contents.get(term)
+            if current is None and term not in held:
+                continue
+            if current != state:
+                self.contents[term] = state
+                added = added or current is None
+                changed = True
+
+        if changed:
+            self.touch(reshaped=added)
+
     def write_contents(self):
         """
         Write the contents to the file
-        Done on settle
+        Done on settle. Terms written meanwhile by other processes are merged in first
+        """
+        with locked(self.address):
+            self.merge(self.read_contents())
+
+            sorted_contents = []
+
+            # Creates a tuple for each term (term, checked)
+            for term, czeched in self.contents.items():
+                sorted_contents.append((term, czeched))
+            sorted_contents.sort()
+
+            # Writes each term beside the log then swaps it in, so a reader never sees half a log
+            temp = self.address + ".tmp"
+            with open(temp, "w") as filee:
+                for trm in sorted_contents:
+                    line_to_write = ''.join([';' if trm[1] == Term.checked else '', trm[0], '\n'])
+                    filee.write(line_to_write)
+            os.replace(temp, self.address)
+            self.drop_journal()
+
+        self.changed = set()
+        self.mark_written()
+
+    def delete(self):
+        """
+        Deletes the file of the log with its journal, then the lock file beside it (see locked)
+        """
+        with locked(self.address):
+            os.remove(self.address)
+            self.drop_journal()
+        try:
+            os.remove(self.address + ".lock")
+        except FileNotFoundError:
+            pass
+
+    def drop_journal(self):
+        """
+        Deletes the journal, once the file holds everything in it
+        """
+        try:
+            os.remove(self.journal_address)
+        except FileNotFoundError:
+            pass
+        self.journaled = 0
+
+    def load(self):
+        """
+        Reads the contents through the loader on first access, when the log was registered without them
         """
-        filee = open(self.address, "w")
-        sorted_contents = []
+        if self.loader:
+            loader, self.loader = self.loader, None
+            loader()
 
-        # Creates a tuple for each term (term, checked)
-        for term, czeched in self.contents.items():
-            sorted_contents.append((term, czeched))
-        sorted_contents.sort()
+    def mark_written(self):
+        """
+        Marks the contents as matching the file
+        """
+        self.written = self.version
 
-        # Writes each term to the contents
-        for trm in sorted_contents:
-            line_to_write = ''.join([';' if trm[1] == Term.checked else '', trm[0], '\n'])
-            filee.write(line_to_write)
+    def is_dirty(self) -> bool:
+        """
+        Returns if the contents changed since they were last written or matched to the file
+        """
+        return self.version != self.written
 
     def post(self):
         """
         Prints the contents of a single log
         """
+        self.load()
         line = []
         lines = []
         contents = sorted(list(self.contents.items()))
@@ -695,6 +1559,7 @@ class Log:
         :param term: String of term
         :return: boolean if term is in log
         """
+        self.load()
         return term in self.contents
 
     def check(self, terms):
@@ -702,24 +1567,61 @@ class Log:
         Checks a term or terms
         :param terms: The term or list of terms you wish to check
         """
-        if type(terms) is not list:
-            terms = [terms]
-
-        for _entr in terms:
-            if _entr in self.contents:
-                self.contents[_entr] = Term.checked
+        self.toggle(terms, Term.checked)
 
     def uncheck(self, terms):
         """
         Unchecks a term or terms
         :param terms: The term or list of terms you wish to uncheck
         """
+        self.toggle(terms, Term.unchecked)
+
+    def toggle(self, terms, state):
+        """
+        Sets a term or terms to checked or unchecked.
+        When journaling, the change is appended to the journal at once rather than waiting on settle
+        :param terms: The term or list of terms
+        :param Term state: Term.checked or Term.unchecked
+        """
+        self.load()
         if type(terms) is not list:
             terms = [terms]
 
+        was_dirty = self.is_dirty()
+        toggled = self.flip(terms, state)
+        if not toggled:
+            return
+        self.touch()
+
+        if not self.journal:
+            self.changed.update(toggled)
+        else:
+            mark = ";" if state == Term.checked else "+"
+            with locked(self.address):
+                with open(self.journal_address, "a") as filee:
+                    filee.write("".join(mark + x + "\n" for x in toggled))
+            self.journaled += len(toggled)
+
+            # The file and journal still hold everything, unless there was more to settle already
+            if not was_dirty:
+                self.mark_written()
+            if self.journaled > self.journal:
+                self.write_contents()
+
+    def flip(self, terms, state) -> list:
+        """
+        Sets each term found in the log to the state
+        :param list terms: The terms to set
+        :param Term state: Term.checked or Term.unchecked
+        :return: The terms that changed
+        :rtype: list
+        """
+        toggled = []
         for _entr in terms:
-            if _entr in self.contents:
-                self.contents[_entr] = Term.unchecked
+            if _entr in self.contents and self.contents[_entr] != state:
+                self.contents[_entr] = state
+                toggled.append(_entr)
+        return toggled
 
     def is_checked(self, term):
         """
@@ -727,11 +1629,2127 @@ class Log:
         :param term: The term to check if it is checked
         :return: boolean if in log
         """
+        self.load()
         if term in self.contents:
             return self.contents[term] == Term.checked
         return False
 
 
-class Term(Enum):
-    checked = 1
-    unchecked = 2
+class CompactLog(Log):
+    """
+    CompactLog: A log keeping its terms as one sorted list with a byte of state each, rather than a dict of Terms.
+    Resets work on the whole byte array at once, and contents are a view over both
+    :param title: Title of the log
+    :param root: The folder containing the log
+    :param order: The order that is tracked from the attributes
+    :param journal: Number of toggles kept in the journal before folding them into the log. 0 keeps no journal
+    :param held: Function taking an order and terms, returning those that files in storage still carry
+    """
+
+    def __init__(self, title, root, order, journal=0, held=None):
+        self.terms = []
+        self.states = bytearray()
+        super().__init__(title, root, order, journal, held)
+
+    @property
+    def contents(self):
+        return CompactContents(self)
+
+    @contents.setter
+    def contents(self, contents):
+        self.terms = sorted(contents)
+        self.states = bytearray(contents[x].value for x in self.terms)
+
+    def find(self, term) -> int:
+        """
+        Returns where the term is kept, or -1 if it isn't in the log
+        :param str term: The term to find
+        :rtype: int
+        """
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return -1
+
+    def add(self, terms, checked=True):
+        """
+        Adds a term to the log
+        :return: Number of terms added
+        """
+        self.load()
+        if not terms:
+            print("Failed to add term: Term left blank")
+
+        if type(terms) != list:
+            terms = [terms]
+
+        new_terms = sorted({str(x) for x in terms if self.find(str(x)) < 0})
+        if not new_terms:
+            return 0
+
+        state = Term.checked.value if checked else Term.unchecked.value
+        if len(new_terms) == 1:
+            i = bisect.bisect_left(self.terms, new_terms[0])
+            self.terms.insert(i, new_terms[0])
+            self.states.insert(i, state)
+        else:
+            merged = sorted(itertools.chain(zip(self.terms, self.states), zip(new_terms, itertools.repeat(state))))
+            self.terms = [x[0] for x in merged]
+            self.states = bytearray(x[1] for x in merged)
+        self.touch(reshaped=True)
+        return len(new_terms)
+
+    def sorted_terms(self) -> list:
+        """
+        Returns the terms of the log in order, as they are always kept
+        :rtype: list[str]
+        """
+        return self.terms
+
+    def get_to_pull(self, checked=False, unchecked=False) -> list:
+        """
+        Returns the contents of log
+        :param checked: True if you want only checked
+        :param unchecked: True if you only want unchecked
+        :return: contents of log
+        :rtype: list of str
+        """
+        self.load()
+        if checked == unchecked:
+            return list(self.terms)
+
+        bias = Term.checked.value if checked else Term.unchecked.value
+        return list(itertools.compress(self.terms, self.states.translate(term_flags[bias])))
+
+    def check_all_contents(self):
+        """
+        Resets the log so that every term is checked
+        """
+        self.load()
+        self.states = bytearray([Term.checked.value]) * len(self.states)
+        self.changed.update(self.terms)
+        self.touch()
+
+    def flip(self, terms, state) -> list:
+        """
+        Sets each term found in the log to the state
+        :param list terms: The terms to set
+        :param Term state: Term.checked or Term.unchecked
+        :return: The terms that changed
+        :rtype: list
+        """
+        toggled = []
+        for _entr in terms:
+            i = self.find(_entr)
+            if i >= 0 and self.states[i] != state.value:
+                self.states[i] = state.value
+                toggled.append(_entr)
+        return toggled
+
+
+class CompactContents(collections.abc.MutableMapping):
+    """
+    CompactContents: The contents of a CompactLog, seen as a dictionary of term: Term
+    :param CompactLog log: The log holding the terms
+    """
+
+    def __init__(self, log):
+        self.log = log
+
+    def __getitem__(self, term):
+        i = self.log.find(term)
+        if i < 0:
+            raise KeyError(term)
+        return term_states[self.log.states[i]]
+
+    def __setitem__(self, term, state):
+        i = self.log.find(term)
+        if i < 0:
+            i = bisect.bisect_left(self.log.terms, term)
+            self.log.terms.insert(i, term)
+            self.log.states.insert(i, state.value)
+            self.log.touch(reshaped=True)
+        else:
+            self.log.states[i] = state.value
+
+    def __delitem__(self, term):
+        i = self.log.find(term)
+        if i < 0:
+            raise KeyError(term)
+        del self.log.terms[i]
+        del self.log.states[i]
+        self.log.touch(reshaped=True)
+
+    def __contains__(self, term):
+        return self.log.find(term) >= 0
+
+    def __iter__(self):
+        return iter(self.log.terms)
+
+    def __len__(self):
+        return len(self.log.terms)
+
+    def items(self):
+        return zip(self.log.terms, (term_states[x] for x in self.log.states))
+
+
+class Index:
+    """
+    Index: An inverted index of the storage folder, kept beside the logs
+    Maps each term of each order to the files carrying it, so pulls are set operations instead of folder scans.
+    Its file table doubles as the manifest of files already seen, alongside a snapshot of each storage folder.
+    Storage may be sharded into sub-folders, keyed by the first attribute or a hash of the name
+    :param root: The folder containing the logs
+    :param storage: The storage folder being indexed
+    :param layout: flat, attribute or hash. None keeps the layout the index was saved with
+    :param width: Number of hex digits naming each folder of the hash layout
+    :param Stats stats: [Optional] Timers and counters of scoro
+    """
+    name = "storage.idx"
+    layouts = ("flat", "attribute", "hash")
+
+    # Folder times this close to the snapshot can't be trusted to catch a change made in the same tick
+    granularity = 2 * 10 ** 9
+
+    # Fewest added files worth parsing on a pool of processes
+    parallel_minimum = 50000
+
+    def __init__(self, root, storage, layout=None, width=2, stats=None):
+        self.address = root.rstrip("/") + "/" + self.name
+        self.storage = os.path.abspath(storage)
+        self.stats = stats or Stats()
+
+        # files: relative path -> terms, postings: order -> {term: set(relative paths)}
+        self.files = {}
+        self.postings = {}
+        self.arity = {}
+
+        # Files by the folder holding them, and the folder times last listed. The storage folder itself is ''
+        self.folders = {}
+        self.snapshot = {}
+        self.layout = "flat"
+        self.width = width
+
+        # Next free '__N' duplicate number of each name, so creating a file doesn't probe storage,
+        # and the number of files of each name, counted on first need
+        self.suffixes = {}
+        self.copies = None
+        self.dirty = False
+
+        # Counts each change to the files, so results drawn from them can be kept until storage changes
+        self.changes = 0
+
+        self.load()
+        if layout and [layout, width] != [self.layout, self.width]:
+            self.layout, self.width = layout, width
+            self.dirty = True
+
+    def load(self):
+        """
+        Loads the index from its file. A missing or foreign index is left empty and rebuilt on sync
+        """
+        try:
+            with locked(self.address, shared=True):
+                with open(self.address, "r") as filee:
+                    data = json.load(filee)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("storage") != self.storage:
+            return False
+
+        names = data["files"]
+        for orde, terms in data["postings"].items():
+            self.postings[int(orde)] = {term: {names[i] for i in ids} for term, ids in terms.items()}
+        for length, ids in data["arity"].items():
+            self.arity[int(length)] = {names[i] for i in ids}
+
+        self.files = dict.fromkeys(names)
+        for name in names:
+            self.folders.setdefault(os.path.dirname(name), set()).add(name)
+        self.snapshot = data.get("snapshot", {})
+        self.layout, self.width = data.get("layout", ["flat", self.width])
+
+        if "suffixes" in data:
+            self.suffixes = data["suffixes"]
+        else:
+            for name in names:
+                self.count(name)
+        return True
+
+    def save(self):
+        """
+        Writes the index to its file if anything changed since the last save
+        """
+        if not self.dirty:
+            return False
+
+        with locked(self.address), self.stats.phase("save index"):
+            self.merge()
+            self.write()
+
+        self.dirty = False
+        return True
+
+    def merge(self):
+        """
+        Takes in files and duplicate counters saved by other processes since this index was loaded
+        """
+        try:
+            with open(self.address, "r") as filee:
+                data = json.load(filee)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("storage") != self.storage:
+            return False
+
+        # Only files still in storage, so those removed here aren't brought back
+        for name in data["files"]:
+            if name not in self.files and os.path.exists(os.path.join(self.storage, name)):
+                self.add(name)
+
+        # Counters of names with no file left were released here
+        copies = self.get_copies()
+        for base, following in data.get("suffixes", {}).items():
+            if self.suffixes.get(base, 0) < following and copies.get(base):
+                self.suffixes[base] = following
+        return True
+
+    def write(self):
+        """
+        Writes the index to its file, without locking it
+        """
+        ids = {name: i for i, name in enumerate(self.files)}
+        data = {
+            "storage": self.storage,
+            "files": list(self.files),
+            "postings": {str(orde): {term: sorted(ids[x] for x in members) for term, members in terms.items()}
+                         for orde, terms in self.postings.items()},
+            "arity": {str(length): sorted(ids[x] for x in members) for length, members in self.arity.items()},
+            "snapshot": self.snapshot,
+            "suffixes": self.suffixes,
+            "layout": [self.layout, self.width],
+        }
+
+        # Written beside the index then swapped in, so a reader never sees half of it
+        temp = self.address + ".tmp"
+        with open(temp, "w") as filee:
+            json.dump(data, filee, separators=(",", ":"))
+        os.replace(temp, self.address)
+
+    def add(self, name):
+        """
+        Adds a file of storage to the index
+        :param str name: Path of the file relative to storage
+        """
+        self.count(name)
+        if name in self.files:
+            return False
+
+        terms = split_name(name)
+        self.files[name] = None
+        if self.copies is not None:
+            self.copies[split_suffix(name)[0]] += 1
+        self.folders.setdefault(os.path.dirname(name), set()).add(name)
+        self.arity.setdefault(len(terms), set()).add(name)
+        for orde, term in enumerate(terms, 1):
+            if term:
+                self.postings.setdefault(orde, {}).setdefault(term, set()).add(name)
+
+        self.changes += 1
+        self.dirty = True
+        return True
+
+    def count(self, name):
+        """
+        Moves the duplicate counter of a name past the given file
+        :param str name: Path of the file relative to storage
+        """
+        base, following = split_suffix(name)
+        if self.suffixes.get(base, 0) < following:
+            self.suffixes[base] = following
+            self.dirty = True
+
+    def get_suffix(self, base) -> int:
+        """
+        Returns the next free '__N' duplicate number of a name, 0 while the name itself is free
+        :param str base: Path of the file relative to storage, without any '__N' duplicate mark
+        :rtype: int
+        """
+        return self.suffixes.get(base, 0)
+
+    def get_copies(self) -> collections.Counter:
+        """
+        Returns the number of files of each name, the name itself and its duplicates, counting them on first need
+        :rtype: collections.Counter
+        """
+        if self.copies is None:
+            self.copies = collections.Counter(split_suffix(x)[0] for x in self.files)
+        return self.copies
+
+    def release(self, name):
+        """
+        Counts off a file leaving the index, before it is taken out.
+        Once no file of its name is left the duplicate counter is forgotten, so the name itself is given out again
+        :param str name: Path of the file relative to storage
+        """
+        base, _ = split_suffix(name)
+        copies = self.get_copies()
+        copies[base] -= 1
+        if copies[base] > 0:
+            return False
+
+        del copies[base]
+        if base in self.suffixes:
+            del self.suffixes[base]
+            self.dirty = True
+        return True
+
+    def get_files(self, folder=None) -> set:
+        """
+        Returns the files of the index
+        :param folder: [Optional] Only the files of this folder, '' for storage itself
+        :return: Paths of the files relative to storage
+        :rtype: set
+        """
+        if folder is None:
+            return set(self.files)
+        return set(self.folders.get(folder, ()))
+
+    def get_folders(self) -> set:
+        """
+        Returns the folders holding files of the index, '' for storage itself
+        :rtype: set
+        """
+        return set(self.folders)
+
+    def record(self, logs):
+        """
+        Keeps the terms of the logs beside the files. The index holds no terms, see Catalog
+        :param logs: The logs of scoro
+        """
+        return False
+
+    def claim(self, file_stem, extension):
+        """
+        Creates an empty file in storage under the first free name of the stem, marking duplicates with '__N'.
+        Each claim is normally a single exclusive create, which is also safe against other writers
+        :param str file_stem: The name of the file without extension
+        :param str extension: The extension of the file
+        :return: Tuple of the name of the file and its open descriptor
+        """
+        folder = self.get_folder(file_stem + extension)
+        base = os.path.join(folder, file_stem + extension)
+        i = self.get_suffix(base)
+        while True:
+            name = os.path.join(folder, f"{file_stem}__{i}{extension}") if i else base
+            self.stats.count("claims")
+            try:
+                descriptor = os.open(os.path.join(self.storage, name), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            except FileNotFoundError:
+                # First file of its folder
+                os.makedirs(os.path.join(self.storage, folder), exist_ok=True)
+                continue
+            except FileExistsError:
+                # Made elsewhere since the index last saw storage
+                self.stats.count("collision_probes")
+                self.add(name)
+                i = max(i + 1 if i else 2, self.get_suffix(base))
+                continue
+
+            # A name the index can't take is given back
+            try:
+                self.add(name)
+            except BaseException:
+                os.close(descriptor)
+                os.remove(os.path.join(self.storage, name))
+                raise
+            return name, descriptor
+
+    def discard(self, name):
+        """
+        Removes a file of storage from the index
+        :param str name: Path of the file relative to storage
+        """
+        if name not in self.files:
+            return False
+
+        terms = split_name(name)
+        self.release(name)
+        del self.files[name]
+        folder = self.folders[os.path.dirname(name)]
+        folder.discard(name)
+        if not folder:
+            del self.folders[os.path.dirname(name)]
+        self.arity[len(terms)].discard(name)
+        for orde, term in enumerate(terms, 1):
+            if not term:
+                continue
+            members = self.postings[orde][term]
+            members.discard(name)
+            if not members:
+                del self.postings[orde][term]
+
+        self.changes += 1
+        self.dirty = True
+        return True
+
+    def add_many(self, names, workers=1):
+        """
+        Adds files of storage to the index in one batch, parsing their names on a pool of processes when there are enough
+        :param names: Paths of the files relative to storage
+        :param int workers: Number of processes parsing names
+        """
+        names = [x for x in names if x not in self.files]
+        if not names:
+            return
+
+        if workers <= 1 or len(names) < self.parallel_minimum:
+            parts = [index_names(names)]
+        else:
+            # Several shares per process, so a slow one doesn't hold up the rest
+            shares = [names[i::workers * 4] for i in range(workers * 4)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(index_names, shares))
+
+        for postings, arity, suffixes in parts:
+            for orde, terms in postings.items():
+                known = self.postings.setdefault(orde, {})
+                for term, members in terms.items():
+                    known.setdefault(term, set()).update(members)
+            for length, members in arity.items():
+                self.arity.setdefault(length, set()).update(members)
+            for base, following in suffixes.items():
+                if self.suffixes.get(base, 0) < following:
+                    self.suffixes[base] = following
+
+        self.files.update(dict.fromkeys(names))
+        if self.copies is not None:
+            self.copies.update(split_suffix(x)[0] for x in names)
+        for name in names:
+            self.folders.setdefault(os.path.dirname(name), set()).add(name)
+        self.changes += 1
+        self.dirty = True
+
+    def sync(self, full=False, workers=1):
+        """
+        Brings the index up to date with storage, parsing only files added or removed since the last sync.
+        A folder isn't listed at all while it is unchanged since the snapshot
+        :param full: Forgets every file and rescans all of storage
+        :param int workers: Number of processes parsing the names of added files
+        :return: Tuple of the added and removed files
+        """
+        if full:
+            self.clear()
+
+        added, removed = set(), set()
+        folders = self.scan_folder("", added, removed)
+
+        if self.layout != "flat":
+            if folders is None:
+                folders = [x for x in self.snapshot if x]
+            for folder in folders:
+                self.scan_folder(folder, added, removed)
+
+            # Folders taken out of storage altogether
+            for folder in self.get_folders().difference(folders, [""]):
+                removed.update(self.get_files(folder))
+            for folder in set(self.snapshot).difference(folders, [""]):
+                del self.snapshot[folder]
+                self.dirty = True
+
+        with self.stats.phase("parse"):
+            self.add_many(added, workers)
+            for name in removed:
+                self.discard(name)
+        self.stats.count("files_added", len(added))
+        self.stats.count("files_removed", len(removed))
+        return added, removed
+
+    def scan_folder(self, folder, added, removed):
+        """
+        Lists one folder of storage if it changed since the snapshot, noting the files added and removed
+        :param str folder: Path of the folder relative to storage, '' for storage itself
+        :param set added: Gathers the files added
+        :param set removed: Gathers the files removed
+        :return: The sub-folders of storage when it was listed, otherwise None
+        """
+        try:
+            stat = os.stat(os.path.join(self.storage, folder))
+        except FileNotFoundError:
+            return []
+        taken = time.time_ns()
+        previous = self.snapshot.get(folder)
+        if previous and previous[:2] == [stat.st_mtime_ns, stat.st_ino] \
+                and previous[2] - stat.st_mtime_ns > self.granularity:
+            return None
+
+        current = set()
+        folders = []
+        with os.scandir(os.path.join(self.storage, folder)) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_file():
+                    current.add(os.path.join(folder, entry.name))
+                elif not folder and entry.is_dir():
+                    folders.append(entry.name)
+
+        self.stats.count("folders_listed")
+        self.stats.count("files_scanned", len(current))
+        known = self.get_files(folder)
+        added.update(current.difference(known))
+        removed.update(known.difference(current))
+
+        if self.snapshot.get(folder) != [stat.st_mtime_ns, stat.st_ino, taken]:
+            self.snapshot[folder] = [stat.st_mtime_ns, stat.st_ino, taken]
+            self.dirty = True
+        return folders
+
+    def walk(self):
+        """
+        Lists the files of storage as they are found, without the index
+        :return: Generator of paths relative to storage
+        """
+        folders = []
+        with os.scandir(self.storage) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_file():
+                    yield entry.name
+                elif self.layout != "flat" and entry.is_dir():
+                    folders.append(entry.name)
+
+        for folder in folders:
+            with os.scandir(os.path.join(self.storage, folder)) as entries:
+                for entry in entries:
+                    if not entry.name.startswith(".") and entry.is_file():
+                        yield os.path.join(folder, entry.name)
+
+    def get_folder(self, name) -> str:
+        """
+        Returns the folder a file of the given name belongs in under the layout
+        :param str name: The file name, without any '__N' duplicate mark
+        :return: Path of the folder relative to storage, '' for storage itself
+        :rtype: str
+        """
+        if self.layout == "attribute":
+            folder = split_name(name)[0] or "_"
+
+            # Attributes that would leave storage or hide the folder from scans are hashed instead.
+            # No attribute starts with '_', so these never meet a folder of another attribute
+            if folder.startswith(".") or os.sep in folder or (os.altsep and os.altsep in folder):
+                folder = f"_{zlib.crc32(folder.encode()):08x}"
+            return folder
+        if self.layout == "hash":
+            return f"{zlib.crc32(name.encode()):08x}"[:self.width]
+        return ""
+
+    def reshard(self, layout, width=2) -> int:
+        """
+        Moves every file of storage into the folder of a new layout, keeping their names.
+        A name already taken in its new folder is given the next '__N' duplicate mark
+        :param str layout: flat, attribute or hash
+        :param int width: Number of hex digits naming each folder of the hash layout
+        :return: Number of files moved
+        :rtype: int
+        """
+        # Every folder is listed, whichever layout storage was left in
+        self.layout = None
+        self.snapshot = {}
+        self.sync()
+        self.layout, self.width = layout, width
+        self.dirty = True
+
+        moved = 0
+        for name in self.get_files():
+            base = os.path.basename(split_suffix(name)[0])
+            folder = self.get_folder(base)
+            target = os.path.join(folder, os.path.basename(name))
+            if target == name:
+                continue
+
+            if os.path.lexists(os.path.join(self.storage, target)):
+                target, descriptor = self.claim(*os.path.splitext(base))
+                os.close(descriptor)
+            elif folder:
+                os.makedirs(os.path.join(self.storage, folder), exist_ok=True)
+
+            os.replace(os.path.join(self.storage, name), os.path.join(self.storage, target))
+            self.discard(name)
+            self.add(target)
+            moved += 1
+
+        # Folders left empty, and their times, are of no more use
+        folders = self.get_folders()
+        with os.scandir(self.storage) as entries:
+            for entry in entries:
+                if not entry.name.startswith(".") and entry.is_dir() and entry.name not in folders:
+                    try:
+                        os.rmdir(entry.path)
+                    except OSError:
+                        pass
+        self.snapshot = {}
+        return moved
+
+    def clear(self):
+        """
+        Empties the index and forgets the snapshot
+        """
+        self.files = {}
+        self.postings = {}
+        self.arity = {}
+        self.folders = {}
+        self.snapshot = {}
+        self.suffixes = {}
+        self.copies = None
+        self.changes += 1
+        self.dirty = True
+
+    def get_terms(self, order) -> dict:
+        """
+        Returns the terms found in storage for an order and the files carrying each
+        :param int order: The order of the attribute
+        :rtype: dict
+        """
+        return self.postings.get(order, {})
+
+    def get_files_of(self, order, terms) -> set:
+        """
+        Returns the files carrying any of the terms at an order
+        :param int order: The order of the attribute
+        :param terms: The terms
+        :rtype: set
+        """
+        postings = self.get_terms(order)
+        found = set()
+        for term in terms:
+            found.update(postings.get(term, ()))
+        return found
+
+    def estimate(self, order, terms) -> int:
+        """
+        Returns how many files carry any of the terms at an order
+        :param int order: The order of the attribute
+        :param terms: The terms
+        :rtype: int
+        """
+        postings = self.get_terms(order)
+        return sum(len(postings.get(x, ())) for x in terms)
+
+    def count_files(self) -> int:
+        """
+        Returns the number of files of the index
+        :rtype: int
+        """
+        return len(self.files)
+
+    def has_file(self, name) -> bool:
+        """
+        Returns if a file is in the index
+        :param str name: Path of the file relative to storage
+        :rtype: bool
+        """
+        return name in self.files
+
+    def facet(self, order) -> dict:
+        """
+        Returns the number of files carrying each term of an order
+        :param int order: The order of the attribute
+        :rtype: dict
+        """
+        return {term: len(members) for term, members in self.get_terms(order).items()}
+
+    def select(self, selection, match=False) -> set:
+        """
+        Returns the files carrying the unchecked terms of a selection
+        :param Selection selection: The compiled unchecked terms
+        :param match: If each file needs to fit every order that has terms to get
+        :rtype: set
+        """
+        if not match:
+            found = set()
+            for position, terms in selection.any_plan:
+                postings = self.get_terms(position + 1)
+                for term in terms:
+                    found.update(postings.get(term, ()))
+            return found
+
+        # Narrowest orders first, so the intersection shrinks as early as it can
+        found = None
+        for position, terms in selection.match_plan:
+            postings = self.get_terms(position + 1)
+            allowed = set()
+            for term in terms:
+                allowed.update(postings.get(term, ()))
+
+            # Files too short to carry this order aren't held to it
+            for length, members in self.arity.items():
+                if length <= position:
+                    allowed.update(members)
+
+            found = allowed if found is None else found & allowed
+            if not found:
+                break
+
+        return set(self.files) if found is None else found
+
+
+class Catalog(Index):
+    """
+    Catalog: The index kept in an SQLite database beside the logs, rather than in memory.
+    Files are rows with a column for each order, each indexed, beside a table of the terms of each log.
+    Pulls are then a single query, and opening scoro over a catalog reads nothing of storage or the database up front
+    :param root: The folder containing the logs
+    :param storage: The storage folder being indexed
+    :param layout: flat, attribute or hash. None keeps the layout the catalog was saved with
+    :param width: Number of hex digits naming each folder of the hash layout
+    :param Stats stats: [Optional] Timers and counters of scoro
+    """
+    name = "storage.db"
+
+    def __init__(self, root, storage, layout=None, width=2, stats=None):
+        self.address = root.rstrip("/") + "/" + self.name
+        self.storage = os.path.abspath(storage)
+        self.stats = stats or Stats()
+        self.snapshot = {}
+        self.layout = "flat"
+        self.width = width
+        self.dirty = False
+        self.changes = 0
+
+        # Number of order columns, and the version of each log last recorded
+        self.columns = 0
+        self.recorded = {}
+
+        # Calls come from the threads of AsyncScoro too, one at a time. Each change is its own short transaction,
+        # so other writers are never kept waiting on an open one
+        self.connection = sqlite3.connect(self.address, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        self.load()
+        if layout and [layout, width] != [self.layout, self.width]:
+            self.layout, self.width = layout, width
+            self.dirty = True
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Runs the statements within as one transaction, committed on leaving. Joins a transaction already open
+        """
+        if self.connection.in_transaction:
+            yield
+            return
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    @property
+    def files(self) -> dict:
+        """
+        Returns the files of the catalog, as the file table of the index
+        :rtype: dict
+        """
+        return dict.fromkeys(x for x, in self.connection.execute("SELECT name FROM files"))
+
+    def load(self):
+        """
+        Opens the tables of the catalog, making them if missing. A catalog of another storage is emptied
+        """
+        with self.transaction():
+            self.connection.execute("CREATE TABLE IF NOT EXISTS files "
+                                    "(name TEXT PRIMARY KEY, folder TEXT NOT NULL, arity INTEGER NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_folder ON files (folder)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_arity ON files (arity)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS terms "
+                                    "(orde INTEGER, term TEXT, checked INTEGER NOT NULL, PRIMARY KEY (orde, term))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS suffixes "
+                                    "(base TEXT PRIMARY KEY, following INTEGER, copies INTEGER NOT NULL DEFAULT 0)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+            # Catalogs made before the files of each name were counted
+            if "copies" not in [x[1] for x in self.connection.execute("PRAGMA table_info(suffixes)")]:
+                self.connection.execute("ALTER TABLE suffixes ADD COLUMN copies INTEGER NOT NULL DEFAULT 0")
+                names = self.connection.execute("SELECT name FROM files")
+                copies = collections.Counter(split_suffix(x)[0] for x, in names)
+                self.connection.executemany("UPDATE suffixes SET copies = ? WHERE base = ?",
+                                            ((number, base) for base, number in copies.items()))
+                self.connection.execute("DELETE FROM suffixes WHERE copies <= 0")
+
+        self.columns = self.read_columns()
+
+        meta = {key: json.loads(value) for key, value in self.connection.execute("SELECT key, value FROM meta")}
+        if meta.get("storage", self.storage) != self.storage:
+            self.clear()
+            return False
+
+        self.snapshot = meta.get("snapshot", {})
+        self.layout, self.width = meta.get("layout", ["flat", self.width])
+        return True
+
+    def save(self):
+        """
+        Writes the snapshot and layout of the catalog if anything changed since the last save.
+        Files and terms are committed as they change
+        """
+        if not self.dirty:
+            return False
+
+        meta = {"storage": self.storage, "snapshot": self.snapshot, "layout": [self.layout, self.width]}
+        with self.stats.phase("save index"), self.transaction():
+            self.connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                        [(key, json.dumps(value)) for key, value in meta.items()])
+        self.dirty = False
+        return True
+
+    def read_columns(self) -> int:
+        """
+        Returns the number of order columns the files table has, which other processes may have added to
+        :rtype: int
+        """
+        columns = [x[1] for x in self.connection.execute("PRAGMA table_info(files)")]
+        return sum(1 for x in columns if re.fullmatch(r"t\d+", x))
+
+    def has_column(self, order) -> bool:
+        """
+        Returns if the files table has a column for an order, reading the table again when it seems not to
+        :param int order: The order of the attribute
+        :rtype: bool
+        """
+        if order > self.columns:
+            self.columns = self.read_columns()
+        return order <= self.columns
+
+    def widen(self, length):
+        """
+        Adds indexed columns for orders up to the given one. Columns added meanwhile by other processes are read
+        again within the transaction first, so none is added twice
+        :param int length: The highest order needing a column
+        """
+        if self.columns >= length:
+            return
+
+        with self.transaction():
+            self.columns = self.read_columns()
+            while self.columns < length:
+                self.columns += 1
+                self.connection.execute(f"ALTER TABLE files ADD COLUMN t{self.columns} TEXT")
+                self.connection.execute(f"CREATE INDEX files_t{self.columns} ON files (t{self.columns})")
+
+    def add(self, name):
+        """
+        Adds a file of storage to the catalog
+        :param str name: Path of the file relative to storage
+        """
+        with self.transaction():
+            added = self.insert(catalog_rows([name])) > 0
+            self.count(name, int(added))
+            return added
+
+    def insert(self, rows) -> int:
+        """
+        Inserts rows made by catalog_rows, skipping files already in the catalog
+        :return: Number of files added
+        :rtype: int
+        """
+        added = 0
+        with self.transaction():
+            for length, members in rows.items():
+                self.widen(length)
+                columns = "".join(f", t{i}" for i in range(1, length + 1))
+                marks = ", ?" * (length + 3)
+                cursor = self.connection.executemany(
+                    f"INSERT OR IGNORE INTO files (name, folder, arity{columns}) VALUES ({marks[2:]})", members)
+                added += cursor.rowcount
+
+        if added:
+            self.changes += 1
+            self.dirty = True
+        return added
+
+    def count(self, name, copies=0):
+        """
+        Moves the duplicate counter of a name past the given file
+        :param str name: Path of the file relative to storage
+        :param int copies: Number of files of the name added
+        """
+        self.connection.execute("INSERT INTO suffixes VALUES (?, ?, ?) ON CONFLICT (base) DO UPDATE SET "
+                                "following = max(following, excluded.following), copies = copies + excluded.copies",
+                                (*split_suffix(name), copies))
+        self.dirty = True
+
+    def release(self, name):
+        """
+        Counts off a file leaving the catalog, forgetting the duplicate counter once no file of its name is left
+        :param str name: Path of the file relative to storage
+        """
+        base, _ = split_suffix(name)
+        self.connection.execute("UPDATE suffixes SET copies = copies - 1 WHERE base = ?", (base,))
+        return self.connection.execute("DELETE FROM suffixes WHERE base = ? AND copies <= 0", (base,)).rowcount > 0
+
+    def get_suffix(self, base) -> int:
+        """
+        Returns the next free '__N' duplicate number of a name, see Index.get_suffix
+        :rtype: int
+        """
+        found = self.connection.execute("SELECT following FROM suffixes WHERE base = ?", (base,)).fetchone()
+        return found[0] if found else 0
+
+    def get_files(self, folder=None) -> set:
+        """
+        Returns the files of the catalog, see Index.get_files
+        :rtype: set
+        """
+        if folder is None:
+            return set(self.files)
+        return {x for x, in self.connection.execute("SELECT name FROM files WHERE folder = ?", (folder,))}
+
+    def get_folders(self) -> set:
+        """
+        Returns the folders holding files of the catalog, '' for storage itself
+        :rtype: set
+        """
+        return {x for x, in self.connection.execute("SELECT DISTINCT folder FROM files")}
+
+    def discard(self, name):
+        """
+        Removes a file of storage from the catalog
+        :param str name: Path of the file relative to storage
+        """
+        with self.transaction():
+            if not self.connection.execute("DELETE FROM files WHERE name = ?", (name,)).rowcount:
+                return False
+            self.release(name)
+
+        self.changes += 1
+        self.dirty = True
+        return True
+
+    def add_many(self, names, workers=1):
+        """
+        Adds files of storage to the catalog in one batch, parsing their names on a pool of processes when there are enough
+        :param names: Paths of the files relative to storage
+        :param int workers: Number of processes parsing names
+        """
+        names = list(names)
+        if not names:
+            return
+
+        # Only files not in the catalog yet count as copies of their names
+        present = set()
+        for i in range(0, len(names), 500):
+            share = names[i:i + 500]
+            present.update(x for x, in self.connection.execute(
+                f"SELECT name FROM files WHERE name IN ({', '.join('?' * len(share))})", share))
+
+        if workers <= 1 or len(names) < self.parallel_minimum:
+            parts = [catalog_rows(names)]
+        else:
+            shares = [names[i::workers * 4] for i in range(workers * 4)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(catalog_rows, shares))
+
+        with self.transaction():
+            for rows in parts:
+                self.insert(rows)
+            self.connection.executemany("INSERT INTO suffixes VALUES (?, ?, ?) ON CONFLICT (base) DO UPDATE SET "
+                                        "following = max(following, excluded.following), "
+                                        "copies = copies + excluded.copies",
+                                        ((*split_suffix(x), int(x not in present)) for x in names))
+        self.dirty = True
+
+    def sync(self, full=False, workers=1):
+        """
+        Brings the catalog up to date with storage, see Index.sync. Changes are committed at once
+        """
+        found = super().sync(full, workers)
+        self.save()
+        return found
+
+    def clear(self):
+        """
+        Empties the catalog and forgets the snapshot. The terms of the logs are kept
+        """
+        with self.transaction():
+            self.connection.execute("DELETE FROM files")
+            self.connection.execute("DELETE FROM suffixes")
+        self.snapshot = {}
+        self.changes += 1
+        self.dirty = True
+
+    def record(self, logs):
+        """
+        Writes the terms of each log changed since last recorded to the terms table
+        :param logs: The logs of scoro
+        """
+        orders = set()
+        with self.transaction():
+            for log in logs:
+                orders.add(log.order)
+
+                # Logs not read yet keep the terms recorded before
+                if self.recorded.get(log.order) == log.version or log.loader:
+                    continue
+
+                self.connection.execute("DELETE FROM terms WHERE orde = ?", (log.order,))
+                self.connection.executemany("INSERT INTO terms VALUES (?, ?, ?)",
+                                            ((log.order, term, state is Term.checked)
+                                             for term, state in log.get_contents().items()))
+                self.recorded[log.order] = log.version
+                self.dirty = True
+
+            # Logs since deleted
+            for orde in set(self.recorded).difference(orders):
+                self.connection.execute("DELETE FROM terms WHERE orde = ?", (orde,))
+                del self.recorded[orde]
+                self.dirty = True
+        return True
+
+    def get_terms(self, order) -> dict:
+        """
+        Returns the terms found in storage for an order. Only the terms are given, not their files
+        :param int order: The order of the attribute
+        :rtype: dict
+        """
+        if not self.has_column(order):
+            return {}
+        return dict.fromkeys(x for x, in self.connection.execute(
+            f"SELECT DISTINCT t{order} FROM files WHERE t{order} IS NOT NULL"))
+
+    def get_files_of(self, order, terms) -> set:
+        """
+        Returns the files carrying any of the terms at an order, see Index.get_files_of
+        :rtype: set
+        """
+        found = set()
+        for share in self.shares(order, terms):
+            found.update(x for x, in self.connection.execute(
+                f"SELECT name FROM files WHERE t{order} IN ({', '.join('?' * len(share))})", share))
+        return found
+
+    def estimate(self, order, terms) -> int:
+        """
+        Returns how many files carry any of the terms at an order, see Index.estimate
+        :rtype: int
+        """
+        return sum(self.connection.execute(
+            f"SELECT COUNT(*) FROM files WHERE t{order} IN ({', '.join('?' * len(share))})", share).fetchone()[0]
+            for share in self.shares(order, terms))
+
+    def count_files(self) -> int:
+        """
+        Returns the number of files of the catalog
+        :rtype: int
+        """
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def has_file(self, name) -> bool:
+        """
+        Returns if a file is in the catalog
+        :rtype: bool
+        """
+        return self.connection.execute("SELECT 1 FROM files WHERE name = ?", (name,)).fetchone() is not None
+
+    def facet(self, order) -> dict:
+        """
+        Returns the number of files carrying each term of an order, see Index.facet
+        :rtype: dict
+        """
+        if not self.has_column(order):
+            return {}
+        return dict(self.connection.execute(
+            f"SELECT t{order}, COUNT(*) FROM files WHERE t{order} IS NOT NULL GROUP BY t{order}"))
+
+    def shares(self, order, terms) -> list:
+        """
+        Splits terms into lists short enough to be parameters of one query, none when no file carries the order
+        :rtype: list[list[str]]
+        """
+        if not self.has_column(order):
+            return []
+        terms = list(terms)
+        return [terms[i:i + 500] for i in range(0, len(terms), 500)]
+
+    def select(self, selection, match=False) -> set:
+        """
+        Returns the files carrying the unchecked terms of the logs, as recorded in the terms table
+        :param Selection selection: The compiled unchecked terms, giving the orders to query narrowest first
+        :param match: If each file needs to fit every order that has terms to get
+        :rtype: set
+        """
+        clauses = []
+        for position, _ in selection.match_plan if match else selection.any_plan:
+            orde = position + 1
+            if not self.has_column(orde):
+                # No file carries this order, so it can't hold back any
+                continue
+
+            wanted = f"t{orde} IN (SELECT term FROM terms WHERE orde = {orde} AND NOT checked)"
+            if match:
+                # Files too short for the order fit it too. Kept as two indexed searches rather than an OR
+                clauses.append(f"SELECT name FROM (SELECT name FROM files WHERE {wanted} "
+                               f"UNION ALL SELECT name FROM files WHERE arity < {orde})")
+            else:
+                clauses.append(wanted)
+
+        if not clauses:
+            return self.get_files() if match else set()
+        if match:
+            query = " INTERSECT ".join(clauses)
+        else:
+            query = "SELECT name FROM files WHERE " + " OR ".join(clauses)
+        return {x for x, in self.connection.execute(query)}
+
+
+class TextIndex:
+    """
+    TextIndex: The words in the contents of each file of storage, kept beside the logs so queries can filter
+    on what files say without reading them. Words are runs of letters, digits and '_', without case
+    :param root: The folder containing the logs
+    :param storage: The storage folder being indexed
+    """
+    name = "contents.idx"
+
+    # Fewest files worth reading on a pool of processes
+    parallel_minimum = 1000
+
+    def __init__(self, root, storage):
+        self.address = root.rstrip("/") + "/" + self.name
+        self.storage = os.path.abspath(storage)
+
+        # documents: relative path -> [mtime_ns, size] when read, postings: word -> set(relative paths)
+        self.documents = {}
+        self.postings = {}
+
+        # Words of each file, for taking a file back out
+        self.words = {}
+        self.dirty = False
+
+        self.load()
+
+    def load(self):
+        """
+        Loads the text index from its file. A missing or foreign one is left empty
+        """
+        try:
+            with locked(self.address, shared=True):
+                with open(self.address, "r") as filee:
+                    data = json.load(filee)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("storage") != self.storage:
+            return False
+
+        self.take(data)
+        return True
+
+    def take(self, data, missing_only=False):
+        """
+        Takes in the files of a saved text index
+        :param dict data: The text index as saved
+        :param missing_only: Only takes files unknown here that are still in storage, when merging
+        """
+        names = data["files"]
+        words = {}
+        for word, ids in data["postings"].items():
+            for i in ids:
+                words.setdefault(names[i], []).append(word)
+
+        for name, stamp in zip(names, data["stamps"]):
+            if missing_only and (name in self.documents or not os.path.exists(os.path.join(self.storage, name))):
+                continue
+            self.enter(name, words.get(name, ()), stamp)
+
+    def save(self):
+        """
+        Writes the text index to its file if anything changed since the last save,
+        taking in first the files indexed by other processes meanwhile
+        """
+        if not self.dirty:
+            return False
+
+        with locked(self.address):
+            try:
+                with open(self.address, "r") as filee:
+                    data = json.load(filee)
+                if data.get("storage") == self.storage:
+                    self.take(data, missing_only=True)
+            except (OSError, ValueError):
+                pass
+
+            names = list(self.documents)
+            ids = {name: i for i, name in enumerate(names)}
+            data = {
+                "storage": self.storage,
+                "files": names,
+                "stamps": [self.documents[x] for x in names],
+                "postings": {word: sorted(ids[x] for x in members) for word, members in self.postings.items()},
+            }
+            temp = self.address + ".tmp"
+            with open(temp, "w") as filee:
+                json.dump(data, filee, separators=(",", ":"))
+            os.replace(temp, self.address)
+
+        self.dirty = False
+        return True
+
+    def enter(self, name, words, stamp):
+        """
+        Puts the words of a file in the text index, in place of any it had
+        :param str name: Path of the file relative to storage
+        :param words: The words of the file
+        :param list stamp: [mtime_ns, size] of the file when read
+        """
+        self.discard(name)
+        words = tuple(set(words))
+        for word in words:
+            self.postings.setdefault(word, set()).add(name)
+        self.words[name] = words
+        self.documents[name] = list(stamp)
+        self.dirty = True
+
+    def add(self, name, content):
+        """
+        Indexes the contents of a file as it is written
+        :param str name: Path of the file relative to storage
+        :param str content: The contents written
+        """
+        stat = os.stat(os.path.join(self.storage, name))
+        self.enter(name, split_words(content), [stat.st_mtime_ns, stat.st_size])
+
+    def discard(self, name):
+        """
+        Takes a file out of the text index
+        :param str name: Path of the file relative to storage
+        """
+        if name not in self.documents:
+            return False
+
+        for word in self.words.pop(name):
+            members = self.postings[word]
+            members.discard(name)
+            if not members:
+                del self.postings[word]
+        del self.documents[name]
+        self.dirty = True
+        return True
+
+    def backfill(self, names, workers=1, full=False) -> int:
+        """
+        Indexes the files not yet indexed or changed since, reading them on a pool of processes when there are enough.
+        Files no longer given are taken out
+        :param names: Paths of every file of storage, relative to it
+        :param int workers: Number of processes reading files
+        :param full: Reads every file again
+        :return: Number of files read
+        :rtype: int
+        """
+        names = set(names)
+        for name in set(self.documents).difference(names):
+            self.discard(name)
+
+        stale = []
+        for name in names:
+            if full or name not in self.documents:
+                stale.append(name)
+                continue
+            try:
+                stat = os.stat(os.path.join(self.storage, name))
+            except FileNotFoundError:
+                self.discard(name)
+                continue
+            if [stat.st_mtime_ns, stat.st_size] != self.documents[name]:
+                stale.append(name)
+
+        paths = [os.path.join(self.storage, x) for x in stale]
+        if workers <= 1 or len(stale) < self.parallel_minimum:
+            parts = [read_words(paths)]
+        else:
+            shares = [paths[i::workers * 4] for i in range(workers * 4)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(read_words, shares))
+
+        read = 0
+        for part in parts:
+            for path, words, stamp in part:
+                self.enter(os.path.relpath(path, self.storage), words, stamp)
+                read += 1
+        return read
+
+    def search(self, words) -> set:
+        """
+        Returns the files containing any of the words
+        :param words: Words, or glob patterns of words such as 'cinnamon*'
+        :rtype: set
+        """
+        found = set()
+        for word in words:
+            word = word.lower()
+            if any(x in word for x in "*?["):
+                match = re.compile(fnmatch.translate(word)).match
+                for known, members in self.postings.items():
+                    if match(known):
+                        found.update(members)
+            else:
+                found.update(self.postings.get(word, ()))
+        return found
+
+
+def weakly(method, default=None):
+    """
+    Wraps a bound method, holding its object only weakly so that logs don't keep scoro from closing
+    :param method: The bound method
+    :param default: Returned once the object is gone
+    :return: Function calling the method
+    """
+    reference = weakref.WeakMethod(method)
+
+    def call(*args):
+        found = reference()
+        return found(*args) if found else default
+    return call
+
+
+@contextlib.contextmanager
+def locked(address, shared=False):
+    """
+    Holds an advisory lock on a file for as long as the block runs.
+    The lock is taken on a '.lock' file beside it, as the file itself is replaced on each write.
+    Where locks aren't offered, nothing is locked
+    :param str address: Path of the file to lock
+    :param shared: Takes a shared lock for reading, rather than an exclusive one for writing
+    """
+    if not fcntl:
+        yield
+        return
+
+    with open(address + ".lock", "a") as filee:
+        fcntl.flock(filee.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(filee.fileno(), fcntl.LOCK_UN)
+
+
+def index_names(names) -> tuple:
+    """
+    Parses a share of the files of storage for the index, on a worker process during a parallel scan
+    :param list[str] names: Paths of the files relative to storage
+    :return: Tuple of postings (order: {term: [files]}), files by number of terms, and duplicate counters
+    :rtype: tuple
+    """
+    postings = {}
+    arity = {}
+    suffixes = {}
+    for name in names:
+        terms = split_name(name)
+        arity.setdefault(len(terms), []).append(name)
+        for orde, term in enumerate(terms, 1):
+            if term:
+                postings.setdefault(orde, {}).setdefault(term, []).append(name)
+
+        base, following = split_suffix(name)
+        if suffixes.get(base, 0) < following:
+            suffixes[base] = following
+    return postings, arity, suffixes
+
+
+def catalog_rows(names) -> dict:
+    """
+    Parses a share of the files of storage into rows of the catalog, grouped by their number of terms
+    :param list[str] names: Paths of the files relative to storage
+    :return: Number of terms: [(file, folder, number of terms, *terms)]
+    :rtype: dict
+    """
+    rows = {}
+    for name in names:
+        terms = split_name(name)
+        row = (name, os.path.dirname(name), len(terms), *[x or None for x in terms])
+        rows.setdefault(len(terms), []).append(row)
+    return rows
+
+
+def split_words(text) -> set:
+    """
+    Splits text into the words kept by the text index
+    :param str text: The text
+    :rtype: set
+    """
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def read_words(paths) -> list:
+    """
+    Reads a share of the files of storage for the text index, on a worker process during a backfill
+    :param list[str] paths: Paths of the files
+    :return: List of (path, words, [mtime_ns, size]) of the files still there
+    :rtype: list
+    """
+    read = []
+    for path in paths:
+        try:
+            with open(path, "r", errors="replace") as filee:
+                stat = os.fstat(filee.fileno())
+                read.append((path, split_words(filee.read()), [stat.st_mtime_ns, stat.st_size]))
+        except (FileNotFoundError, IsADirectoryError):
+            continue
+    return read
+
+
+def split_suffix(name) -> tuple:
+    """
+    Splits the '__N' duplicate mark off the name of a stored file
+    :param str name: The file name or path
+    :return: Tuple of the name without the mark, and the first duplicate number after it
+    :rtype: tuple
+    """
+    folder, name = os.path.split(name)
+    stem, extension = os.path.splitext(name)
+    stem, _, number = stem.partition("__")
+    return os.path.join(folder, stem + extension), int(number) + 1 if number.isdigit() else 2
+
+
+def sort_numbers(terms) -> tuple:
+    """
+    Returns the terms that are numbers, in order, beside their values
+    :param terms: The terms
+    :return: Tuple of the list of values and the list of terms
+    :rtype: tuple
+    """
+    numbers = []
+    for term in terms:
+        try:
+            value = float(term)
+        except ValueError:
+            continue
+        if math.isfinite(value):
+            numbers.append((value, term))
+    numbers.sort()
+    return [x[0] for x in numbers], [x[1] for x in numbers]
+
+
+def select_terms(terms, numbers, pattern="", regex="", predicate=None, low=None, high=None) -> list:
+    """
+    Returns the terms meeting every criterion given, see Log.select.
+    Prefixes and ranges are found by bisecting the sorted terms, anything else takes one pass over them
+    :param list terms: The terms, sorted
+    :param numbers: Function returning the terms that are numbers, as sort_numbers does
+    :rtype: list[str]
+    """
+    ranged = low is not None or high is not None
+    if ranged:
+        values, chosen = numbers()
+        start = bisect.bisect_left(values, float(low)) if low is not None else 0
+        end = bisect.bisect_right(values, float(high)) if high is not None else len(values)
+        chosen = chosen[start:end]
+    else:
+        chosen = terms
+
+    if pattern:
+        prefix = re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+        if prefix and not ranged:
+            chosen = chosen[bisect.bisect_left(chosen, prefix):bisect.bisect_left(chosen, prefix + "\U0010ffff")]
+        if pattern != prefix + "*":
+            match = re.compile(fnmatch.translate(pattern)).match
+            chosen = [x for x in chosen if match(x)]
+
+    if regex:
+        search = re.compile(regex).search
+        chosen = [x for x in chosen if search(x)]
+
+    if predicate:
+        chosen = [x for x in chosen if predicate(x)]
+
+    return list(chosen)
+
+
+def split_name(name) -> list:
+    """
+    Splits the name of a stored file into its terms, leaving off the extension and any '__N' duplicate mark
+    :param str name: The file name or path
+    :rtype: list[str]
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem.split("__", 1)[0].split("_")
+
+
+def send_file(file, output, mode="copy") -> int:
+    """
+    Sends a stored file to the output folder
+    :param str file: Path of the file
+    :param str output: Path of the output folder, ending in '/'
+    :param str mode: copy, hardlink, symlink, reflink or move
+    :return: Size of the file in bytes
+    :rtype: int
+    """
+    size = os.path.getsize(file)
+    destination = output + os.path.basename(file)
+
+    # An earlier link here would have the send write through to the stored file
+    if os.path.lexists(destination):
+        os.remove(destination)
+    transfers[mode](file, destination)
+    return size
+
+
+def symlink(source, destination):
+    """
+    Sends a file as a symbolic link to the stored file
+    """
+    os.symlink(os.path.abspath(source), destination)
+
+
+def reflink(source, destination):
+    """
+    Sends a copy sharing the blocks of the stored file where the filesystem allows,
+    otherwise copied within the kernel, and as a plain copy as a last resort
+    """
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        # Either call is missing where the platform doesn't offer it
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except (AttributeError, OSError):
+            try:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+            except (AttributeError, OSError):
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+                shutil.copyfileobj(src, dst)
+    shutil.copymode(source, destination)
+
+
+transfers = {
+    "copy": shutil.copy,
+    "hardlink": os.link,
+    "symlink": symlink,
+    "reflink": reflink,
+    "move": shutil.move,
+}
+
+
+class Stats:
+    """
+    Stats: Timers of each phase of scoro and counters of the work done, such as files scanned or bytes written.
+    While turned off, phases and counts return at once
+    :param enabled: Keeps timers and counters
+    :param hook: [Optional] Function called with the name and seconds of each phase as it ends. Turns on the stats
+    """
+    idle = contextlib.nullcontext()
+
+    def __init__(self, enabled=False, hook=None):
+        self.enabled = bool(enabled or hook)
+        self.hook = hook
+        self.phases = {}
+        self.counters = {}
+
+        # Files are written outside the lock of scoro, so counts have their own
+        self.lock = threading.Lock()
+
+    def phase(self, name):
+        """
+        Times the block as a phase
+        :param str name: Name of the phase
+        """
+        if not self.enabled:
+            return self.idle
+        return self.timed(name)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """
+        Times the block, adding it to the calls and seconds of the phase then calling the hook
+        :param str name: Name of the phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                timer = self.phases.setdefault(name, [0, 0.0])
+                timer[0] += 1
+                timer[1] += elapsed
+            if self.hook:
+                self.hook(name, elapsed)
+
+    def count(self, name, amount=1):
+        """
+        Adds to a counter
+        :param str name: Name of the counter
+        :param int amount: Amount added
+        """
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self) -> dict:
+        """
+        Returns the calls and seconds of each phase, and the counters
+        :rtype: dict
+        """
+        with self.lock:
+            phases = {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in self.phases.items()}
+            return {"phases": phases, "counters": dict(self.counters)}
+
+    def clear(self):
+        """
+        Starts the timers and counters over
+        """
+        with self.lock:
+            self.phases = {}
+            self.counters = {}
+
+
+class Watcher:
+    """
+    Watcher: Files made, removed or renamed in storage and its folders, as told by inotify.
+    Only offered on Linux, raising OSError elsewhere
+    :param Index index: The index of the storage to watch, giving its folders
+    """
+    made = 0x00000100 | 0x00000080  # IN_CREATE | IN_MOVED_TO
+    gone = 0x00000200 | 0x00000040  # IN_DELETE | IN_MOVED_FROM
+    overflow = 0x00004000  # IN_Q_OVERFLOW
+    folder = 0x40000000  # IN_ISDIR
+    header = struct.Struct("iIII")
+
+    def __init__(self, index):
+        path = ctypes.util.find_library("c")
+        try:
+            self.libc = ctypes.CDLL(path, use_errno=True)
+            self.libc.inotify_init1, self.libc.inotify_add_watch
+        except (OSError, AttributeError):
+            raise OSError("inotify is not offered here")
+
+        self.index = index
+        self.descriptor = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.descriptor < 0:
+            raise OSError(ctypes.get_errno(), "inotify could not be opened")
+
+        # Folder of each watch, relative to storage
+        self.watches = {}
+        self.overflowed = False
+        self.add("")
+        if index.layout != "flat":
+            for entry in os.scandir(index.storage):
+                if entry.is_dir() and not entry.name.startswith("."):
+                    self.add(entry.name)
+
+    def add(self, folder):
+        """
+        Watches a folder of storage
+        :param str folder: Path of the folder relative to storage, '' for storage itself
+        """
+        path = os.path.join(self.index.storage, folder).encode()
+        watch = self.libc.inotify_add_watch(self.descriptor, path, self.made | self.gone)
+        if watch < 0:
+            raise OSError(ctypes.get_errno(), f"Could not watch {path}")
+        self.watches[watch] = folder
+
+    def read(self, timeout) -> set:
+        """
+        Waits for events, then takes all that are waiting
+        :param float timeout: Longest seconds waited for the first event
+        :return: Paths relative to storage that were made, removed or renamed
+        :rtype: set
+        """
+        self.overflowed = False
+        changed = set()
+        if not select.select([self.descriptor], [], [], max(timeout, 0))[0]:
+            return changed
+
+        while True:
+            try:
+                data = os.read(self.descriptor, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                watch, mask, _, length = self.header.unpack_from(data, offset)
+                offset += self.header.size
+                name = data[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+                offset += length
+
+                if mask & self.overflow:
+                    self.overflowed = True
+                    continue
+                folder = self.watches.get(watch)
+                if folder is None or not name or name.startswith("."):
+                    continue
+
+                if mask & self.folder:
+                    # Only folders of a sharded storage hold files
+                    if folder or self.index.layout == "flat":
+                        continue
+                    if mask & self.made:
+                        self.add(name)
+                        with os.scandir(os.path.join(self.index.storage, name)) as entries:
+                            changed.update(os.path.join(name, x.name) for x in entries
+                                           if not x.name.startswith(".") and x.is_file())
+                    else:
+                        changed.update(self.index.get_files(name))
+                    continue
+
+                changed.add(os.path.join(folder, name))
+        return changed
+
+    def close(self):
+        """
+        Stops watching
+        """
+        os.close(self.descriptor)
+
+
+class Selection:
+    """
+    Selection: The unchecked terms of each log, compiled for testing many files against.
+    Orders are tried most telling first, so most files are settled by their first term
+    :param dict terms_to_get: order: set of unchecked terms
+    :param dict sizes: order: number of terms in the log
+    """
+
+    def __init__(self, terms_to_get, sizes):
+        self.terms = {orde: frozenset(terms) for orde, terms in terms_to_get.items()}
+
+        # Orders without anything unchecked hold no file back, so they are left out
+        constrained = [(len(terms) / max(sizes.get(orde, 1), 1), orde - 1, terms)
+                       for orde, terms in self.terms.items() if terms]
+
+        # Matching fails fastest on the narrowest orders, anything else is found fastest in the widest
+        constrained.sort(key=operator.itemgetter(0, 1))
+        self.match_plan = tuple((position, terms) for _, position, terms in constrained)
+        self.any_plan = self.match_plan[::-1]
+
+    def is_wanted(self, terms, match=False) -> bool:
+        """
+        Returns if a file with the terms is pulled
+        :param list terms: The terms of the file, see split_name
+        :param match: If the file needs to fit each order that has terms to get
+        :rtype: bool
+        """
+        length = len(terms)
+        if match:
+            for position, allowed in self.match_plan:
+                if position < length and terms[position] not in allowed:
+                    return False
+            return True
+
+        for position, allowed in self.any_plan:
+            if position < length and terms[position] in allowed:
+                return True
+        return False
+
+
+class Query:
+    """
+    Query: A boolean expression over the terms of the logs, such as 'type in {pie,tarte} AND NOT fruit=kiwi AND stars>=2'.
+    Clauses are log=term, log!=term, log in {term,term}, log not in {...}, log~regex and the number comparisons
+    <, <=, > and >=. A term with *, ? or [ is a glob pattern unless quoted. Clauses join with AND, OR, NOT and parentheses.
+    CONTAINS word and CONTAINS {word,...} find files by the words of their contents, from a text index.
+    Raises ValueError for an expression it can't read
+    :param str expression: The query
+    """
+    lexer = re.compile(r'\s*(?:(!=|<=|>=|[(){},=<>~])|"((?:[^"\\]|\\.)*)"|([^\s(){},!=<>~"]+))')
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = []
+        self.position = 0
+
+        expression = expression.rstrip()
+        at = 0
+        while at < len(expression):
+            found = self.lexer.match(expression, at)
+            if not found:
+                raise ValueError(f"Unexpected '{expression[at:].strip()[:1]}' at {at}")
+            symbol, quoted, word = found.groups()
+            if symbol is not None:
+                self.tokens.append(("symbol", symbol))
+            elif quoted is not None:
+                self.tokens.append(("quoted", re.sub(r"\\(.)", r"\1", quoted)))
+            else:
+                self.tokens.append(("word", word))
+            at = found.end()
+
+        if not self.tokens:
+            raise ValueError("Empty query")
+        self.tree = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError(f"Unexpected '{self.tokens[self.position][1]}'")
+
+    def peek(self, kind, text=None, ahead=0) -> bool:
+        """
+        Returns if the next token, or one further ahead, is of a kind and of the text given. Words are compared without case
+        """
+        if self.position + ahead >= len(self.tokens):
+            return False
+        token = self.tokens[self.position + ahead]
+        if token[0] != kind:
+            return False
+        return text is None or (token[1].upper() == text if kind == "word" else token[1] == text)
+
+    def take(self, kind=None, text=None) -> str:
+        """
+        Returns the next token, raising ValueError unless it is of the kind and text given
+        """
+        if self.position >= len(self.tokens):
+            raise ValueError(f"Query ends early, expected {text or kind or 'more'}")
+        if kind and not self.peek(kind, text):
+            raise ValueError(f"Expected {text or kind}, found '{self.tokens[self.position][1]}'")
+        self.position += 1
+        return self.tokens[self.position - 1][1]
+
+    def parse_or(self):
+        """
+        Reads clauses joined by OR
+        """
+        children = [self.parse_and()]
+        while self.peek("word", "OR"):
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def parse_and(self):
+        """
+        Reads clauses joined by AND, which binds tighter than OR
+        """
+        children = [self.parse_not()]
+        while self.peek("word", "AND"):
+            self.take()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def parse_not(self):
+        """
+        Reads a clause, a NOT before one, or a query in parentheses
+        """
+        if self.peek("word", "NOT"):
+            self.take()
+            return "not", self.parse_not()
+        if self.peek("symbol", "("):
+            self.take()
+            node = self.parse_or()
+            self.take("symbol", ")")
+            return node
+        return self.parse_clause()
+
+    def parse_clause(self):
+        """
+        Reads a clause as ('clause', log, operator, values), inside a 'not' for != and not in
+        """
+        if not (self.peek("word") or self.peek("quoted")):
+            raise ValueError(f"Expected a log, found '{self.take()}'")
+
+        # Unless it is the title of a log being compared
+        if self.peek("word", "CONTAINS") and (self.peek("quoted", ahead=1) or self.peek("symbol", "{", ahead=1) or (
+                self.peek("word", ahead=1) and not self.peek("word", "IN", 1) and not self.peek("word", "NOT", 1))):
+            self.take()
+            return "contains", self.parse_values()
+        log = self.take()
+
+        negated = False
+        if self.peek("word", "NOT"):
+            self.take()
+            self.take("word", "IN")
+            operator, negated = "=", True
+        elif self.peek("word", "IN"):
+            self.take()
+            operator = "="
+        else:
+            operator = self.take("symbol")
+            if operator == "!=":
+                operator, negated = "=", True
+            elif operator not in ("=", "~", "<", "<=", ">", ">="):
+                raise ValueError(f"Unknown comparison '{operator}'")
+
+        values = self.parse_values() if operator == "=" else [self.parse_value()]
+        clause = ("clause", log, operator, values)
+        return ("not", clause) if negated else clause
+
+    def parse_values(self) -> list:
+        """
+        Reads a term, or terms in braces such as {pie,tarte}
+        """
+        if not self.peek("symbol", "{"):
+            return [self.parse_value()]
+
+        self.take()
+        values = []
+        while True:
+            values.append(self.parse_value())
+            if self.peek("symbol", "}"):
+                self.take()
+                return values
+            self.take("symbol", ",")
+
+    def parse_value(self) -> tuple:
+        """
+        Reads a term as a tuple of its text, and if it is a glob pattern
+        """
+        if self.peek("quoted"):
+            return self.take(), False
+        value = self.take("word")
+        return value, any(x in value for x in "*?[")
+
+    def resolve(self, logs, index, text=None, node=None):
+        """
+        Turns each clause into the terms of its order it stands for, read from the index so that terms of files
+        the logs don't hold yet are found too. Raises ValueError for a log not found or a bad regex or number
+        :param dict logs: title: Log
+        :param Index index: The index of storage
+        :param TextIndex text: [Optional] The text index, for CONTAINS
+        :return: The tree with clauses as ('terms', order, frozenset of terms), and CONTAINS as ('files', frozenset)
+        """
+        node = self.tree if node is None else node
+        kind = node[0]
+        if kind in ("and", "or"):
+            return kind, [self.resolve(logs, index, text, x) for x in node[1]]
+        if kind == "not":
+            return kind, self.resolve(logs, index, text, node[1])
+
+        if kind == "contains":
+            if text is None:
+                raise ValueError("Contents aren't indexed, open scoro with text=True")
+            files = set()
+            for value, pattern in node[1]:
+                if pattern:
+                    files.update(text.search([value]))
+                    continue
+
+                # Every word of a phrase, anywhere in the file
+                found = None
+                for word in split_words(value):
+                    found = text.search([word]) if found is None else found & text.search([word])
+                files.update(found or ())
+            return "files", frozenset(files)
+
+        _, title, operator, values = node
+        if title not in logs:
+            raise ValueError(f"Log not found: {title}")
+        orde = logs[title].get_order()
+        known = sorted(index.get_terms(orde))
+        select = functools.partial(select_terms, known, functools.partial(sort_numbers, known))
+
+        terms = set()
+        if operator == "=":
+            for value, pattern in values:
+                if pattern:
+                    terms.update(select(pattern=value))
+                else:
+                    terms.add(value)
+        elif operator == "~":
+            try:
+                terms.update(select(regex=values[0][0]))
+            except re.error as error:
+                raise ValueError(f"Bad regex {values[0][0]}: {error}")
+        else:
+            try:
+                bound = float(values[0][0])
+            except ValueError:
+                raise ValueError(f"Not a number: {values[0][0]}")
+            strict = (lambda x: float(x) != bound) if operator in ("<", ">") else None
+            if operator.startswith("<"):
+                terms.update(select(high=bound, predicate=strict))
+            else:
+                terms.update(select(low=bound, predicate=strict))
+        return "terms", orde, frozenset(terms)
+
+    def evaluate(self, node, index) -> set:
+        """
+        Returns the files of the index fitting a resolved tree.
+        Each AND takes its narrowest clauses first and stops once nothing is left. A clause wider than what is left
+        is checked against the names left, rather than gathering its files
+        :param node: Tree given by resolve
+        :param Index index: The index of storage
+        :rtype: set
+        """
+        kind = node[0]
+        if kind == "terms":
+            return index.get_files_of(node[1], node[2])
+        if kind == "files":
+            return {x for x in node[1] if index.has_file(x)}
+        if kind == "not":
+            return index.get_files().difference(self.evaluate(node[1], index))
+        if kind == "or":
+            found = set()
+            for child in sorted(node[1], key=lambda x: -self.estimate(x, index)):
+                found.update(self.evaluate(child, index))
+            return found
+
+        # (estimate, clause), clauses under a NOT taken out of it
+        including = sorted(((self.estimate(x, index), x) for x in node[1] if x[0] != "not"),
+                           key=operator.itemgetter(0))
+        excluding = sorted(((self.estimate(x[1], index), x[1]) for x in node[1] if x[0] == "not"),
+                           key=operator.itemgetter(0), reverse=True)
+
+        found = None
+        for size, child in including:
+            if found is not None and child[0] == "terms" and len(found) < size:
+                found = {x for x in found if self.term_of(x, child[1]) in child[2]}
+            else:
+                files = self.evaluate(child, index)
+                found = files if found is None else found & files
+            if not found:
+                return set()
+
+        if found is None:
+            found = index.get_files()
+        for size, child in excluding:
+            if child[0] == "terms" and len(found) < size:
+                found = {x for x in found if self.term_of(x, child[1]) not in child[2]}
+            else:
+                found.difference_update(self.evaluate(child, index))
+            if not found:
+                break
+        return found
+
+    def estimate(self, node, index) -> int:
+        """
+        Returns about how many files fit a resolved tree, for ordering clauses
+        :rtype: int
+        """
+        kind = node[0]
+        if kind == "terms":
+            return index.estimate(node[1], node[2])
+        if kind == "files":
+            return len(node[1])
+        if kind == "not":
+            return max(index.count_files() - self.estimate(node[1], index), 0)
+        if kind == "or":
+            return sum(self.estimate(x, index) for x in node[1])
+        return min(self.estimate(x, index) for x in node[1])
+
+    @staticmethod
+    def term_of(name, order):
+        """
+        Returns the term of a file for an order, or None if the name is too short to carry one
+        """
+        terms = split_name(name)
+        return terms[order - 1] if order <= len(terms) else None
+
+
+class Term(Enum):
+    checked = 1
+    unchecked = 2
+
+
+# Term by the byte a CompactLog keeps for it
+term_states = (None, Term.checked, Term.unchecked)
+
+# Byte translations picking out one state from a CompactLog
+term_flags = {x.value: bytes(int(i == x.value) for i in range(256)) for x in Term}
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from scoro import Scoro
+
+
+def synthesize(storage, size, attributes, cardinality, seed=0):
+    """
+    Fills a storage folder with empty files named by random terms, as if made by create
+    :param str storage: Path of the storage folder
+    :param int size: Number of files
+    :param tuple attributes: Fewest and most terms in a file name
+    :param int cardinality: Number of different terms of each order
+    :param int seed: Seed of the random names, so runs are comparable
+    """
+    rand = random.Random(seed)
+    copies = {}
+    for _ in range(size):
+        length = rand.randint(*attributes)
+        stem = "_".join(f"{chr(97 + orde)}{rand.randrange(cardinality)}" for orde in range(length))
+
+        # Duplicates are marked like those of create
+        copies[stem] = copies.get(stem, 0) + 1
+        name = f"{stem}__{copies[stem]}.txt" if copies[stem] > 1 else stem + ".txt"
+        open(os.path.join(storage, name), "w").close()
+
+
+def measure(operation, memory=True) -> dict:
+    """
+    Runs an operation once, timing it and tracing the most memory it took
+    :param operation: Function taking no arguments
+    :param memory: Traces memory, which slows the operation down
+    :return: Seconds elapsed and peak bytes, or None when memory isn't traced
+    :rtype: dict
+    """
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    operation()
+    elapsed = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"seconds": elapsed, "peak_bytes": peak}
+
+
+def bench(size, attributes, cardinality, created=1000, memory=True, **options) -> list:
+    """
+    Times renew, create, pull and settle over one synthesized storage
+    :param int size: Number of files in storage
+    :param tuple attributes: Fewest and most terms in a file name
+    :param int cardinality: Number of different terms of each order
+    :param int created: Number of files made by create and by create_many
+    :param memory: Traces peak memory of each operation
+    Every other option is passed on to Scoro, such as compact, catalog or shard
+    :return: Result of each operation
+    :rtype: list[dict]
+    """
+    root = tempfile.mkdtemp(prefix="scoro_bench_")
+    storage = os.path.join(root, "storage")
+    logs = os.path.join(root, "logs")
+    output = os.path.join(root, "output")
+    os.makedirs(storage)
+    synthesize(storage, size, attributes, cardinality)
+    titles = [f"order{i}" for i in range(1, attributes[1] + 1)]
+
+    results = []
+    found = {}
+    scoro = None
+
+    def record(name, operation, files):
+        result = measure(operation, memory)
+        result.update({"operation": name, "files": files,
+                       "throughput": files / result["seconds"] if result["seconds"] else None})
+        results.append(result)
+
+    def open_scoro():
+        nonlocal scoro
+        scoro = Scoro(storage=storage, logs=logs, output=output, initialized_titles=titles, close=False, **options)
+
+    def pull(match):
+        found[match] = scoro.pull(match=match)
+
+    try:
+        record("renew (cold)", open_scoro, size)
+        record("settle", scoro.settle, size)
+        record("renew (reopen)", open_scoro, size)
+        record("renew (warm)", scoro.renew, size)
+
+        # A tenth of the terms of the first two orders are to be pulled
+        wanted = [str(x) for x in range(max(cardinality // 10, 1))]
+        scoro.uncheck([f"a{x}" for x in wanted], titles[0])
+        if len(titles) > 1:
+            scoro.uncheck([f"b{x}" for x in wanted], titles[1])
+        record("pull", lambda: pull(False), size)
+        record("pull (match)", lambda: pull(True), size)
+
+        attributes_made = [[f"{chr(97 + orde)}{x % cardinality}" for orde in range(attributes[0])]
+                           for x in range(created)]
+        record("create", lambda: [scoro.create(x, "") for x in attributes_made], created)
+        record("create_many", lambda: scoro.create_many([(x, "") for x in attributes_made]), created)
+        record("settle (after create)", scoro.settle, size + created * 2)
+    finally:
+        scoro.close = False
+        shutil.rmtree(root, ignore_errors=True)
+
+    for result in results:
+        result.update({"size": size, "attributes": list(attributes), "cardinality": cardinality})
+    results.append({"operation": "pulled", "size": size, "files": len(found.get(False, ())),
+                    "matched": len(found.get(True, ()))})
+    return results
+
+
+def compare(results, baseline):
+    """
+    Prints the time of each operation against that of an earlier run
+    :param list results: Results of this run
+    :param list baseline: Results of the earlier run
+    """
+    key = lambda x: (x["operation"], x["size"], tuple(x.get("attributes", ())), x.get("cardinality"))
+    earlier = {key(x): x for x in baseline if "seconds" in x}
+    for result in results:
+        before = earlier.get(key(result))
+        if before and "seconds" in result:
+            ratio = result["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+            print(f"{result['operation']:>24} {result['size']:>9}: {ratio:6.2f}x the time of the baseline")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times renew, create, pull and settle of scoro at scale")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Numbers of files in storage, up to 1000000")
+    parser.add_argument("--attributes", type=int, nargs=2, default=[2, 4], metavar=("FEWEST", "MOST"),
+                        help="Fewest and most terms in each file name")
+    parser.add_argument("--cardinality", type=int, default=100, help="Number of different terms of each order")
+    parser.add_argument("--created", type=int, default=1000, help="Number of files made by create and create_many")
+    parser.add_argument("--no-memory", action="store_true", help="Doesn't trace memory, for closer timings")
+    parser.add_argument("--compact", action="store_true", help="Opens scoro with compact logs")
+    parser.add_argument("--catalog", action="store_true", help="Opens scoro with the SQLite catalog")
+    parser.add_argument("--shard", default=None, help="Storage layout: flat, attribute or hash")
+    parser.add_argument("--output", default="bench_output.txt", help="Path of the JSON results")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    # The baseline is read before anything is run, and never written over by the results
+    baseline = None
+    if args.baseline:
+        if os.path.abspath(args.baseline) == os.path.abspath(args.output):
+            parser.error("--baseline and --output are the same file, give another --output")
+        with open(args.baseline, "r") as filee:
+            baseline = json.load(filee)["results"]
+
+    options = {"compact": args.compact, "catalog": args.catalog, "shard": args.shard}
+    results = []
+    for size in args.sizes:
+        for result in bench(size, tuple(args.attributes), args.cardinality, args.created,
+                            not args.no_memory, **options):
+            if "seconds" in result:
+                peak = f"{result['peak_bytes'] / 2 ** 20:9.1f} MiB" if result["peak_bytes"] is not None else ""
+                print(f"{result['operation']:>24} {size:>9}: {result['seconds']:9.3f}s "
+                      f"{result['throughput'] or 0:12.0f} files/s {peak}")
+            results.append(result)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options,
+        "results": results,
+    }
+    with open(args.output, "w") as filee:
+        json.dump(report, filee, indent=2)
+
+    if baseline is not None:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
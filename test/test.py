@@ -1,7 +1,13 @@
+import asyncio
+import threading
+import time
 import unittest
+import weakref
 import random
+import sqlite3
+import tempfile
 
-from scoro import Scoro
+from scoro import Scoro, AsyncScoro, CompactLog, Term
 import os
 
 
@@ -134,6 +140,594 @@ class TestScoro(unittest.TestCase):
 
 
 
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.storage = os.path.join(self.folder.name, "storage")
+        self.logs = os.path.join(self.folder.name, "logs")
+        self.scorotto = Scoro(storage=self.storage, logs=self.logs, output=os.path.join(self.folder.name, "output"))
+        self.scorotto.add_log(["type", "fruit", "stars"])
+
+        for attributes in [["pie", "apple", 3], ["pie", "kiwi", 1], ["cake", "apple", 2], ["cake", "cherry", 3]]:
+            self.scorotto.create(attributes, "Recipe")
+
+    def tearDown(self):
+        self.scorotto.close = False
+        self.folder.cleanup()
+
+    def test_pull_from_index(self):
+        self.scorotto.uncheck("pie", log="type")
+        self.scorotto.uncheck("3", log="stars")
+
+        self.assertEqual(3, len(self.scorotto.pull()))
+        self.assertEqual([self.scorotto.get_storage_path() + "pie_apple_3.txt"], self.scorotto.pull(match=True))
+
+    def test_index_persists(self):
+        self.scorotto.settle()
+        self.assertTrue(os.path.exists(self.scorotto.index.address))
+
+        # Files dropped in by hand are picked up on the next renew or pull
+        open(self.scorotto.get_storage_path() + "tarte_kiwi_2.txt", "w").close()
+        reopened = Scoro(storage=self.storage, logs=self.logs, close=False)
+        self.assertEqual(5, len(reopened.index.files))
+
+        reopened.uncheck("kiwi", log="fruit")
+        self.assertEqual(2, len(reopened.pull()))
+        self.assertTrue("tarte_kiwi_2.txt" in reopened.index.get_terms(2)["kiwi"])
+
+    def test_unchanged_storage_is_not_rescanned(self):
+        storage = self.scorotto.get_storage_path()
+        os.utime(storage, ns=(10 ** 9, 10 ** 9))
+        self.scorotto.index.sync()
+
+        # A folder that still looks untouched isn't listed again, until asked for a full scan
+        open(storage + "tarte_kiwi_2.txt", "w").close()
+        os.utime(storage, ns=(10 ** 9, 10 ** 9))
+        self.assertEqual((set(), set()), self.scorotto.index.sync())
+        self.assertFalse(self.scorotto.has_term("tarte", "type"))
+
+        self.scorotto.renew(full=True)
+        self.assertTrue(self.scorotto.has_term("tarte", "type"))
+
+    def test_bulk_add_logs(self):
+        scans = []
+        sync = self.scorotto.index.sync
+        self.scorotto.index.sync = lambda full=False, workers=1: scans.append(full) or sync(full, workers)
+
+        self.scorotto.delete_log(all=True)
+        self.scorotto.bulk_add_logs([("type", 1), ("fruit", 2), ("stars", 3)])
+
+        self.assertEqual(1, len(scans))
+        self.assertEqual("fruit", self.scorotto.get_log_by_order(2).title)
+        self.assertTrue(self.scorotto.has_term("cherry", "fruit"))
+        self.assertTrue(self.scorotto.has_term("3", "stars"))
+
+    def test_create_many(self):
+        records = [(["pie", "apple", 3], "Recipe")] * 3 + [(("tarte", "kiwi", 2), "Recipe")]
+        created = self.scorotto.create_many(records)
+
+        storage = self.scorotto.get_storage_path()
+        self.assertEqual([storage + "pie_apple_3__2.txt", storage + "pie_apple_3__3.txt",
+                          storage + "pie_apple_3__4.txt", storage + "tarte_kiwi_2.txt"], created)
+        self.assertTrue(self.scorotto.has_term("tarte", "type"))
+        self.assertTrue("pie_apple_3__4.txt" in self.scorotto.index.get_terms(1)["pie"])
+
+    def test_duplicate_suffixes(self):
+        storage = self.scorotto.get_storage_path()
+        self.scorotto.create(["pie", "apple", 3], "Recipe")
+        self.assertTrue(os.path.exists(storage + "pie_apple_3__2.txt"))
+        self.assertEqual(3, self.scorotto.index.suffixes["pie_apple_3.txt"])
+
+        # A duplicate made by another writer is stepped over rather than overwritten
+        open(storage + "pie_apple_3__3.txt", "w").close()
+        self.scorotto.create(["pie", "apple", 3], "Recipe")
+        self.assertTrue(os.path.exists(storage + "pie_apple_3__4.txt"))
+
+        self.scorotto.settle()
+        reopened = Scoro(storage=self.storage, logs=self.logs, close=False)
+        self.assertEqual(5, reopened.index.suffixes["pie_apple_3.txt"])
+
+    def test_transfer_modes(self):
+        self.scorotto.uncheck("pie", log="type")
+        output = self.scorotto.get_output_path()
+
+        for mode in ["copy", "hardlink", "symlink", "reflink"]:
+            self.scorotto.pull(send=True, mode=mode, workers=2)
+            self.assertEqual(mode, self.scorotto.last_transfer["mode"])
+            self.assertEqual(2, self.scorotto.last_transfer["files"])
+            self.assertEqual(len("Recipe") * 2, self.scorotto.last_transfer["bytes"])
+            self.assertEqual(mode == "symlink", os.path.islink(output + "pie_kiwi_1.txt"))
+            with open(output + "pie_kiwi_1.txt") as filee:
+                self.assertEqual("Recipe", filee.read())
+
+        summary = self.scorotto.transfer(self.scorotto.pull(), mode="move")
+        self.assertEqual(2, summary["files"])
+        self.assertEqual([], self.scorotto.pull())
+        self.assertFalse(os.path.exists(self.scorotto.get_storage_path() + "pie_kiwi_1.txt"))
+
+    def test_iter_pull(self):
+        self.scorotto.uncheck(["pie", "3"])
+        for match in [False, True]:
+            self.assertEqual(self.scorotto.pull(match=match), sorted(self.scorotto.iter_pull(match=match)))
+
+        first = next(self.scorotto.iter_pull())
+        self.assertTrue(first in self.scorotto.pull())
+
+        sent = list(self.scorotto.iter_pull(send=True, workers=2))
+        self.assertEqual(sorted(os.path.basename(x) for x in sent), sorted(os.listdir(self.scorotto.get_output_path())))
+
+    def test_selection_is_reused(self):
+        self.scorotto.uncheck("pie", log="type")
+        selection = self.scorotto.get_selection()
+        self.scorotto.pull()
+        self.assertTrue(selection is self.scorotto.get_selection())
+
+        # Any change to a log, even made on the log itself, compiles it again
+        self.scorotto.get_logs_dict()["stars"].uncheck("3")
+        self.assertFalse(selection is self.scorotto.get_selection())
+        self.assertEqual([self.scorotto.get_storage_path() + "pie_apple_3.txt"], self.scorotto.pull(match=True))
+
+        self.assertTrue(self.scorotto.get_selection().is_wanted(["pie", "kiwi", "1"]))
+        self.assertFalse(self.scorotto.get_selection().is_wanted(["pie", "kiwi", "1"], match=True))
+        self.assertFalse(self.scorotto.get_selection().is_wanted(["cake", "kiwi", "1"]))
+
+    def test_settle_skips_untouched_logs(self):
+        self.scorotto.settle()
+        logs = self.scorotto.get_logs_dict()
+        self.assertFalse(any(x.is_dirty() for x in logs.values()))
+
+        # Reopening from matching files leaves every log clean
+        reopened = Scoro(storage=self.storage, logs=self.logs, close=False)
+        self.assertFalse(any(x.is_dirty() for x in reopened.get_logs_dict().values()))
+
+        os.utime(logs["type"].path(), ns=(1, 1))
+        self.scorotto.uncheck("3", log="stars")
+        self.assertTrue(logs["stars"].is_dirty())
+        self.scorotto.settle()
+
+        self.assertEqual(1, os.stat(logs["type"].path()).st_mtime_ns)
+        with open(logs["stars"].path()) as filee:
+            self.assertEqual(";1\n;2\n3\n", filee.read())
+        self.assertFalse(os.path.exists(logs["stars"].path() + ".tmp"))
+
+    def test_journal(self):
+        self.scorotto.settle()
+        journaled = Scoro(storage=self.storage, logs=self.logs, close=False, journal=3)
+        stars = journaled.get_logs_dict()["stars"]
+
+        # Each toggle lands in the journal straight away, leaving the log itself alone
+        journaled.uncheck("3", log="stars")
+        journaled.uncheck("1", log="stars")
+        with open(stars.journal_address) as filee:
+            self.assertEqual("+3\n+1\n", filee.read())
+        with open(stars.path()) as filee:
+            self.assertEqual(";1\n;2\n;3\n", filee.read())
+        self.assertFalse(stars.is_dirty())
+
+        reopened = Scoro(storage=self.storage, logs=self.logs, close=False)
+        self.assertFalse(reopened.get_logs_dict()["stars"].is_checked("3"))
+        self.assertTrue(reopened.get_logs_dict()["stars"].is_checked("2"))
+
+        # Past the threshold the journal is folded into the log
+        journaled.check("3", log="stars")
+        journaled.uncheck("2", log="stars")
+        self.assertFalse(os.path.exists(stars.journal_address))
+        with open(stars.path()) as filee:
+            self.assertEqual("1\n2\n;3\n", filee.read())
+
+    def test_compact_logs(self):
+        self.scorotto.settle()
+        compact = Scoro(storage=self.storage, logs=self.logs, close=False, compact=True)
+        fruit = compact.get_logs_dict()["fruit"]
+        self.assertTrue(isinstance(fruit, CompactLog))
+        self.assertEqual(["apple", "cherry", "kiwi"], fruit.terms)
+        self.assertFalse(fruit.is_dirty())
+
+        compact.create(["tarte", "banana", 2], "Recipe")
+        fruit.add(["fig", "date"], checked=False)
+        self.assertEqual(["apple", "banana", "cherry", "date", "fig", "kiwi"], fruit.terms)
+        self.assertEqual(Term.unchecked, fruit.get_contents()["fig"])
+
+        compact.uncheck(["kiwi", "cherry"], log="fruit")
+        self.assertEqual(["cherry", "date", "fig", "kiwi"], fruit.get_to_pull(unchecked=True))
+        self.assertEqual(2, len(compact.pull(match=True)))
+
+        compact.reset()
+        self.assertEqual([], fruit.get_to_pull(unchecked=True))
+        self.assertTrue(fruit.is_checked("fig"))
+
+        compact.uncheck("apple", log="fruit")
+        compact.settle()
+        with open(fruit.path()) as filee:
+            self.assertEqual("apple\n;banana\n;cherry\n;date\n;fig\n;kiwi\n", filee.read())
+
+    def test_pattern_selection(self):
+        self.scorotto.create_many([(["tarte", "blueberry", 10], ""), (["syrup", "huckleberry", 2.5], "")])
+        for compact in [False, True]:
+            picker = Scoro(storage=self.storage, logs=self.logs, close=False, compact=compact)
+
+            self.assertEqual({"fruit": ["blueberry", "cherry", "huckleberry"]},
+                             picker.select(["*berry", "ch*"], log="fruit", pattern=True))
+            self.assertEqual({"type": ["pie", "syrup"]}, picker.select("^(p|s)", log="type", regex=True))
+            self.assertEqual(["10", "3"], picker.select(log="stars", low=3)["stars"])
+            self.assertEqual(["2", "2.5"], picker.select(log="stars", low=1.5, high=2.5)["stars"])
+            self.assertEqual(["cake"], picker.select(log="type", predicate=lambda x: len(x) == 4)["type"])
+            self.assertEqual({"fruit": []}, picker.select(log="fruit", pattern=True))
+            self.assertEqual({"fruit": []}, picker.select("", log="fruit", regex=True))
+
+            picker.uncheck("*berry", log="fruit", pattern=True)
+            picker.uncheck(log="stars", low=3)
+            self.assertEqual(["blueberry", "huckleberry"],
+                             sorted(picker.get_logs_dict()["fruit"].get_to_pull(unchecked=True)))
+            self.assertEqual([picker.get_storage_path() + "tarte_blueberry_10.txt"], picker.pull(match=True))
+
+            picker.check(log="stars", high=100)
+            self.assertEqual([], picker.get_logs_dict()["stars"].get_to_pull(unchecked=True))
+
+    def test_order_lookups(self):
+        self.assertEqual(4, self.scorotto.get_open_order())
+        self.scorotto.delete_log("fruit")
+        self.assertEqual([], [x for x in os.listdir(self.logs) if x.startswith("fruit_")])
+        self.assertEqual(2, self.scorotto.get_open_order())
+        self.assertEqual(None, self.scorotto.get_log_by_order(2))
+        self.assertEqual(["type", "stars"], [x.title for x in self.scorotto.get_ordered_logs()])
+
+        self.scorotto.add_log(["ingredient", "extra"])
+        self.assertEqual("ingredient", self.scorotto.get_log_by_order(2).title)
+        self.assertEqual("extra", self.scorotto.get_log_by_order(4).title)
+        self.assertEqual([1, 2, 3, 4], [x.order for x in self.scorotto.get_ordered_logs()])
+
+    def test_concurrent_writers_merge(self):
+        self.scorotto.settle()
+        first = Scoro(storage=self.storage, logs=self.logs, close=False)
+        second = Scoro(storage=self.storage, logs=self.logs, close=False)
+
+        first.create(["tarte", "fig", 1], "Recipe")
+        first.uncheck("apple", log="fruit")
+        second.create(["syrup", "date", 2], "Recipe")
+        second.uncheck("kiwi", log="fruit")
+        first.settle()
+        second.settle()
+
+        # Neither writer loses the other's terms, files or toggles
+        reopened = Scoro(storage=self.storage, logs=self.logs, close=False)
+        fruit = reopened.get_logs_dict()["fruit"]
+        self.assertTrue(fruit.in_log("fig") and fruit.in_log("date"))
+        self.assertEqual(["apple", "kiwi"], sorted(fruit.get_to_pull(unchecked=True)))
+        self.assertTrue(second.get_logs_dict()["type"].in_log("tarte"))
+        self.assertTrue("tarte_fig_1.txt" in second.index.files)
+
+    def test_removed_files_drop_terms(self):
+        self.scorotto.settle()
+        os.remove(os.path.join(self.storage, "pie_kiwi_1.txt"))
+
+        # Terms only in the file are not written back once their files are gone
+        reopened = Scoro(storage=self.storage, logs=self.logs, close=False)
+        reopened.settle()
+        with open(os.path.join(self.logs, "fruit_2.lst")) as filee:
+            self.assertEqual([";apple", ";cherry"], filee.read().split())
+        self.assertFalse(reopened.has_term("kiwi", "fruit"))
+
+        # Logs don't hold scoro, so it still settles as soon as it is let go
+        reference = weakref.ref(reopened)
+        del reopened
+        self.assertIsNone(reference())
+
+    def test_released_names(self):
+        for catalog in [False, True]:
+            maker = Scoro(storage=self.storage, logs=self.logs, close=False, catalog=catalog)
+            path = maker.get_storage_path()
+            first = maker.create(["syrup", "date"], "")
+            second = maker.create(["syrup", "date"], "")
+            self.assertEqual(path + "syrup_date__2.txt", second)
+
+            # A duplicate left keeps the counter, and once none is left the name itself is given out again
+            os.remove(first)
+            maker.renew()
+            self.assertEqual(path + "syrup_date__3.txt", maker.create(["syrup", "date"], ""))
+            os.remove(second)
+            os.remove(path + "syrup_date__3.txt")
+            maker.renew()
+            maker.settle()
+            self.assertEqual(path + "syrup_date.txt", maker.create(["syrup", "date"], ""))
+            os.remove(path + "syrup_date.txt")
+            maker.renew()
+            maker.settle()
+
+            reopened = Scoro(storage=self.storage, logs=self.logs, close=False, catalog=catalog)
+            self.assertEqual(0, reopened.index.get_suffix("syrup_date.txt"))
+
+    def test_async_scoro(self):
+        self.scorotto.settle()
+
+        async def ingest():
+            async with await AsyncScoro.open(storage=self.storage, logs=self.logs, concurrency=4) as service:
+                created = await asyncio.gather(*[service.create(["tarte", "fig", i % 3], "Recipe") for i in range(30)])
+                await service.run("uncheck", "fig", log="fruit")
+                return created, await service.pull()
+
+        created, pulled = asyncio.run(ingest())
+        self.assertEqual(30, len(set(created)))
+        self.assertEqual(sorted(created), pulled)
+
+        reopened = Scoro(storage=self.storage, logs=self.logs, close=False)
+        self.assertEqual(["fig"], reopened.get_logs_dict()["fruit"].get_to_pull(unchecked=True))
+
+    def test_parallel_scan(self):
+        self.scorotto.create_many([(["tarte", "fig", i], "Recipe") for i in range(40)])
+        serial = {orde: dict(terms) for orde, terms in self.scorotto.index.postings.items()}
+
+        parallel = Scoro(storage=self.storage, logs=self.logs, close=False, scan_workers=2)
+        parallel.index.parallel_minimum = 0
+        parallel.renew(full=True)
+
+        self.assertEqual(serial, parallel.index.postings)
+        self.assertEqual(self.scorotto.index.suffixes, parallel.index.suffixes)
+        self.assertEqual(44, len(parallel.index.files))
+        self.assertTrue(parallel.has_term("39", "stars"))
+
+    def test_sharded_storage(self):
+        self.assertEqual(4, self.scorotto.reshard("attribute"))
+        self.assertTrue(os.path.isfile(os.path.join(self.storage, "pie", "pie_kiwi_1.txt")))
+
+        sharded = Scoro(storage=self.storage, logs=self.logs, close=False)
+        self.assertEqual("attribute", sharded.index.layout)
+        first = sharded.create(["pie", "fig", "2"], "Recipe")
+        second = sharded.create(["pie", "fig", "2"], "Recipe")
+        self.assertEqual(os.path.join(self.storage, "pie", "pie_fig_2__2.txt"), os.path.normpath(second))
+        self.assertTrue(os.path.isfile(first))
+
+        sharded.uncheck("pie")
+        pulled = sharded.pull()
+        self.assertEqual(sorted(pulled), sorted(sharded.iter_pull()))
+        self.assertEqual(4, len(pulled))
+
+        sharded.reshard("hash", 1)
+        self.assertTrue(all(len(x) == 1 for x in os.listdir(self.storage)))
+        sharded.reshard("flat")
+        self.assertEqual(6, len(os.listdir(self.storage)))
+        sharded.renew(full=True)
+        self.assertEqual(6, len(sharded.index.files))
+
+    def test_unsafe_folders(self):
+        self.scorotto.reshard("attribute")
+        storage = os.path.realpath(self.storage)
+        for attribute in ["..", ".hidden", "."]:
+            made = os.path.realpath(self.scorotto.create([attribute, "esc"], "Recipe"))
+            folder = os.path.relpath(os.path.dirname(made), storage)
+            self.assertEqual(storage, os.path.dirname(os.path.dirname(made)))
+            self.assertTrue(folder.startswith("_"))
+        self.assertEqual("_", self.scorotto.index.get_folder("_esc.txt"))
+
+    def test_catalog(self):
+        cataloged = Scoro(storage=self.storage, logs=self.logs, close=False, catalog=True)
+        self.assertEqual(4, len(cataloged.index.files))
+        cataloged.create(["tarte", "apple"], "Recipe")
+
+        for scoro in (self.scorotto, cataloged):
+            scoro.renew()
+            scoro.uncheck("apple")
+            scoro.uncheck("3", "stars")
+        self.assertEqual(self.scorotto.pull(), cataloged.pull())
+        self.assertEqual(self.scorotto.pull(match=True), cataloged.pull(match=True))
+        self.assertEqual(2, len(cataloged.pull(match=True)))
+        indexes = cataloged.index.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        self.assertIn("files_arity", [x for x, in indexes])
+
+        # Terms are kept in the catalog, while the logs are still written as text
+        cataloged.settle()
+        rows = cataloged.index.connection.execute("SELECT term FROM terms WHERE orde = 2 AND NOT checked")
+        self.assertEqual(["apple"], [x for x, in rows])
+        with open(os.path.join(self.logs, "fruit_2.lst")) as log:
+            self.assertIn("apple", log.read().split())
+
+        reopened = Scoro(storage=self.storage, logs=self.logs, close=False, catalog=True)
+        self.assertEqual(5, len(reopened.index.files))
+        self.assertEqual(3, reopened.index.get_suffix("tarte_apple.txt") + 1)
+
+    def test_catalog_writers(self):
+        first = Scoro(storage=self.storage, logs=self.logs, close=False, catalog=True)
+        second = Scoro(storage=self.storage, logs=self.logs, close=False, catalog=True)
+        second.index.connection.execute("PRAGMA busy_timeout = 1000")
+
+        # Neither writer holds the catalog between calls
+        first.create(["tarte", "apple"], "Recipe")
+        second.create(["tarte", "apple"], "Recipe")
+        self.assertFalse(first.index.connection.in_transaction)
+        self.assertTrue(first.index.has_file("tarte_apple__2.txt"))
+
+        # A claim the catalog can't record leaves no file behind
+        def refuse(rows):
+            raise sqlite3.OperationalError("database is locked")
+        first.index.insert = refuse
+        self.assertRaises(sqlite3.OperationalError, first.create, ["syrup", "date"], "Recipe")
+        self.assertFalse(os.path.exists(os.path.join(self.storage, "syrup_date.txt")))
+        self.assertFalse(first.index.connection.in_transaction)
+
+    def test_catalog_columns(self):
+        storage = os.path.join(self.folder.name, "shared")
+        logs = os.path.join(self.folder.name, "shared_logs")
+        first = Scoro(storage=storage, logs=logs, close=False, catalog=True, initialized_titles=["type", "fruit"])
+        second = Scoro(storage=storage, logs=logs, close=False, catalog=True)
+
+        # Columns one writer adds to an empty catalog are seen by the other
+        first.create(["pie", "apple"], "Recipe")
+        second.create(["cake", "kiwi"], "Recipe")
+        self.assertEqual({"pie", "cake"}, set(second.index.get_terms(1)))
+
+        second.renew()
+        self.assertTrue(second.has_term("pie", "type"))
+        second.uncheck("pie", "type")
+        self.assertEqual([second.get_storage_path() + "pie_apple.txt"], second.pull())
+
+    def test_stats(self):
+        self.assertEqual({"phases": {}, "counters": {}}, self.scorotto.stats())
+
+        phases = []
+        instrumented = Scoro(storage=self.storage, logs=self.logs, close=False, hook=lambda *x: phases.append(x))
+        self.assertEqual(8, instrumented.stats(reset=True)["counters"]["terms_added"])
+        instrumented.create(["pie", "apple", "3"], "Recipe")
+        instrumented.create_many([(["pie", "fig", "5"], "Recipe")])
+        instrumented.pull()
+        instrumented.settle()
+
+        stats = instrumented.stats(reset=True)
+        self.assertEqual(2, stats["phases"]["create"]["calls"])
+        self.assertIn("scan", stats["phases"])
+        self.assertEqual(6, stats["counters"]["files_scanned"])
+        self.assertEqual(2, stats["counters"]["claims"])
+        self.assertNotIn("collision_probes", stats["counters"])
+        self.assertEqual(2, stats["counters"]["terms_added"])
+        self.assertGreater(stats["counters"]["bytes_written"], 12)
+        self.assertIn("settle", [x[0] for x in phases])
+        self.assertEqual({"phases": {}, "counters": {}}, instrumented.stats())
+
+    def test_watch(self):
+        self.scorotto.lock = threading.RLock()
+        storage = self.scorotto.get_storage_path()
+
+        def seen(name):
+            with self.scorotto.lock:
+                return name in self.scorotto.index.files
+
+        for poll in (False, True):
+            stop = threading.Event()
+            watching = threading.Thread(target=self.scorotto.watch,
+                                        kwargs={"interval": 0.05, "debounce": 0.1, "stop": stop, "poll": poll})
+            watching.start()
+            time.sleep(0.2)
+
+            # Made, renamed and removed by another program
+            name = f"tarte_{'fig' if poll else 'plum'}_2.txt"
+            open(storage + name, "w").close()
+            os.rename(storage + "cake_cherry_3.txt", storage + "cake_cherry_4.txt")
+            os.remove(storage + "pie_kiwi_1.txt")
+            for _ in range(100):
+                if seen(name) and not seen("pie_kiwi_1.txt"):
+                    break
+                time.sleep(0.05)
+
+            stop.set()
+            watching.join()
+            self.assertTrue(self.scorotto.has_term("tarte", "type"))
+            self.assertTrue(self.scorotto.has_term("4", "stars"))
+            self.assertFalse(seen("cake_cherry_3.txt"))
+            os.rename(storage + "cake_cherry_4.txt", storage + "cake_cherry_3.txt")
+            open(storage + "pie_kiwi_1.txt", "w").close()
+            self.scorotto.renew()
+
+        # Settled once storage went quiet
+        with open(os.path.join(self.logs, "fruit_2.lst")) as log:
+            self.assertIn(";fig", log.read().split())
+
+    def test_query(self):
+        self.scorotto.create_many([(["tarte", "fig", 2], "Recipe"), (["tarte", "kiwi", 5], "Recipe"),
+                                   (["pie", "plum", 4], "Recipe")])
+        self.scorotto.uncheck("apple")
+        path = self.scorotto.get_storage_path()
+
+        found = self.scorotto.query("type in {pie,tarte} AND NOT fruit=kiwi AND stars>=2")
+        self.assertEqual([path + x for x in ["pie_apple_3.txt", "pie_plum_4.txt", "tarte_fig_2.txt"]], found)
+        self.assertEqual([path + "cake_cherry_3.txt", path + "pie_kiwi_1.txt"],
+                         self.scorotto.query('(fruit=k* OR fruit="cherry") and not stars>3'))
+        self.assertEqual(4, len(self.scorotto.query("stars<3 OR fruit~^pl")))
+        self.assertEqual(4, len(self.scorotto.query("fruit not in {apple, cherry}")))
+
+        # Log state is left alone, and pulls can take a query instead
+        fruit = self.scorotto.get_log_content("fruit")
+        self.assertEqual(["apple"], [x for x, state in fruit.items() if state is Term.unchecked])
+        self.assertEqual(found, self.scorotto.pull(query="type in {pie,tarte} AND NOT fruit=kiwi AND stars>=2"))
+
+        self.assertEqual([], self.scorotto.query("flavor=sweet"))
+        self.assertEqual([], self.scorotto.query("type=pie AND"))
+        self.assertEqual([], self.scorotto.query("type ~ ["))
+
+        # Files dropped in by other programs are found by every kind of clause before any renew
+        open(path + "tarte_plum_5.txt", "w").close()
+        for expression in ("type=tarte AND fruit=plum", "type=tar* AND fruit=plum", "fruit~^pl AND stars>=5"):
+            self.assertIn(path + "tarte_plum_5.txt", self.scorotto.query(expression))
+
+    def test_facets(self):
+        facets = self.scorotto.facets()
+        self.assertEqual({"pie": 2, "cake": 2}, facets["type"])
+        self.assertEqual({"apple": 2, "kiwi": 1, "cherry": 1}, facets["fruit"])
+        self.assertIs(facets, self.scorotto.facets())
+
+        # Counted again once storage changes
+        self.scorotto.create(["pie", "kiwi", 3], "Recipe")
+        self.assertEqual({"pie": 3, "cake": 2}, self.scorotto.facets()["type"])
+
+        self.scorotto.uncheck("kiwi")
+        self.assertEqual({"3": 1, "1": 1}, self.scorotto.facets(selection=True)["stars"])
+        self.assertEqual({"apple": 2, "cherry": 1},
+                         self.scorotto.facets("type=cake OR (stars=3 AND fruit=apple)")["fruit"])
+        self.assertEqual({"pie": 1}, self.scorotto.facets(self.scorotto.pull(match=True)[:1])["type"])
+
+        cataloged = Scoro(storage=self.storage, logs=self.logs, close=False, catalog=True)
+        self.assertEqual(self.scorotto.facets(), cataloged.facets())
+
+    def test_text_index(self):
+        texted = Scoro(storage=self.storage, logs=self.logs, close=False, text=True)
+        self.assertEqual([], texted.query("CONTAINS recipe"))
+        self.assertEqual(4, texted.index_contents())
+        self.assertEqual(0, texted.index_contents())
+
+        texted.create(["pie", "plum", 4], "Plums, Cinnamon and brown sugar")
+        texted.create(["tarte", "apple", 2], "Apples with cinnamon")
+        path = texted.get_storage_path()
+        self.assertEqual([path + "pie_plum_4.txt"], texted.query("type=pie AND CONTAINS cinnamon"))
+        self.assertEqual(2, len(texted.pull(query='CONTAINS "brown sugar" OR (CONTAINS cinn* AND stars<3)')))
+        self.assertEqual(4, len(texted.query("NOT CONTAINS {cinnamon, plums}")))
+
+        # Changed and removed files are read again by the next backfill
+        with open(path + "cake_apple_2.txt", "w") as filee:
+            filee.write("Spiced with cinnamon")
+        os.remove(path + "pie_plum_4.txt")
+        self.assertEqual(1, texted.index_contents())
+        self.assertEqual([path + "cake_apple_2.txt", path + "tarte_apple_2.txt"], texted.query("CONTAINS cinnamon"))
+
+        texted.settle()
+        reopened = Scoro(storage=self.storage, logs=self.logs, close=False, text=True)
+        self.assertEqual(texted.text_index.postings, reopened.text_index.postings)
+        self.assertEqual([], self.scorotto.query("CONTAINS cinnamon"))
+
+    def test_lazy_logs(self):
+        self.scorotto.uncheck("pie", "type")
+        self.scorotto.settle()
+        open(os.path.join(self.storage, "pie_plum_1.txt"), "w").close()
+
+        # Nothing is read until a log is needed, and settling leaves unread logs as they are
+        lazy = Scoro(storage=self.storage, logs=self.logs, close=False, instrument=True, lazy=True)
+        self.assertEqual({"type", "fruit", "stars"}, lazy.unloaded)
+        self.assertFalse({"load index", "scan", "grab"} & set(lazy.stats()["phases"]))
+        lazy.settle()
+        self.assertNotIn("plum", open(os.path.join(self.logs, "fruit_2.lst")).read())
+
+        self.assertTrue(lazy.has_term("plum", "fruit"))
+        self.assertEqual({"type", "stars"}, lazy.unloaded)
+        self.assertEqual(1, lazy.stats()["phases"]["grab"]["calls"])
+
+        eager = Scoro(storage=self.storage, logs=self.logs, close=False)
+        self.assertEqual(eager.pull(), lazy.pull())
+        self.assertEqual(set(), lazy.unloaded)
+        self.assertEqual(eager.get_log_content("type"), lazy.get_log_content("type"))
+
+        # Files made before a log is read reach it through the index
+        lazy = Scoro(storage=self.storage, logs=self.logs, close=False, lazy=True)
+        lazy.create(["tarte", "fig", 4], "Recipe")
+        self.assertEqual(3, len(lazy.query("type=pie")))
+        self.assertIn("fig", lazy.get_log_content("fruit"))
+
+        # Logs read themselves on first access, however they are reached
+        for compact in [False, True]:
+            lazy = Scoro(storage=self.storage, logs=self.logs, close=False, lazy=True, compact=compact)
+            logs = lazy.get_logs_dict()
+            self.assertFalse(logs["type"].is_checked("pie"))
+            self.assertEqual({"fruit", "stars"}, lazy.unloaded)
+            self.assertTrue(logs["fruit"].is_checked("apple"))
+            self.assertTrue(logs["stars"].in_log("1"))
+            self.assertEqual({"apple", "cherry", "fig", "kiwi", "plum"}, set(logs["fruit"].get_contents()))
+
 
 if __name__ == '__main__':
     unittest.setup()